@@ -1,25 +1,105 @@
-from flask import Flask, request, jsonify, session
+from flask import Flask, Response, request, jsonify, session, stream_with_context, make_response, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from flask_session import Session
 import os
-import bcrypt
+import re
+import json
+import base64
+import hashlib
 import functools
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import atexit
-from app import database, User, TaskTypeSettings, DifficultySettings
+from datetime import datetime
+from app import User, TaskTypeSettings, DifficultySettings, TaskFilter, completed_task_key
+from scoring import to_micros
+from serializers import task_to_dict, task_type_setting_to_dict, difficulty_setting_to_dict, iter_json_array, iter_ndjson
+from passwords import PasswordHasher, HasherBusy
+from user_cache import UserCache
+from shards import open_database
+from sqltrace import QueryTracer
+from sessions import ServerSideSessionInterface, MemorySessionStore
+from events import EventHub, encode_event, HEARTBEAT, RESYNC
+import serializers
+import metrics
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify and request.get_json through serializers (orjson when installed)"""
+    def dumps(self, obj, **kwargs):
+        return serializers.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return serializers.loads(s)
+
+    def response(self, *args, **kwargs):
+        with metrics.phase("serialize"):
+            body = serializers.dumps(self._prepare_response_obj(args, kwargs))
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+class TimedSessionInterface:
+    """Delegates to the configured session interface, timing session load and save"""
+    def __init__(self, inner):
+        self.inner = inner
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def open_session(self, app, request):
+        with metrics.phase("session_open"):
+            return self.inner.open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with metrics.phase("session_save"):
+            return self.inner.save_session(app, session, response)
+
+def timed_wsgi_app(wsgi_app):
+    """Stamp the request start before Flask opens the session, so route latency includes it"""
+    @functools.wraps(wsgi_app)
+    def wrapper(environ, start_response):
+        environ['queup.request_start'] = time.perf_counter()
+        return wsgi_app(environ, start_response)
+    return wrapper
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', '0ed6181591343759e70ba7ff19f6b9efdf026b5b36552b76bf101c238246d81b')
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SESSION_PERMANENT'] = False
-app.config['SESSION_USE_SIGNER'] = True
-Session(app)
+app.wsgi_app = timed_wsgi_app(app.wsgi_app)
 CORS(app, supports_credentials=True)
 
-db = database("tasks.db")
+# SQL_TRACE=1 times every statement, counts queries per request and logs slow ones with their query plan
+tracer = QueryTracer(slow_threshold=float(os.environ.get('SQL_SLOW_MS', 50)) / 1000) if os.environ.get('SQL_TRACE') else None
+# GROUP_COMMIT_MS=5 commits writes from concurrent requests together, waiting up to that long for company
+group_commit_ms = os.environ.get('GROUP_COMMIT_MS')
+# DB_SHARDS=4 spreads users over four SQLite files (see shards.py); once sharded, the recorded count is used by default
+db = open_database("tasks.db", shards=int(os.environ.get('DB_SHARDS', 0)) or None, tracer=tracer, group_commit=bool(group_commit_ms), commit_delay=float(group_commit_ms or 0) / 1000,
+              commit_batch=int(os.environ.get('GROUP_COMMIT_BATCH', 64)), max_pending_writes=int(os.environ.get('GROUP_COMMIT_MAX_PENDING', 1024)))
+
+# Sessions live in the database by default; SESSION_STORE=memory keeps them in this process only
+session_store = MemorySessionStore(int(os.environ.get('SESSION_MEMORY_SIZE', 10000))) if os.environ.get('SESSION_STORE') == 'memory' else db
+app.session_interface = TimedSessionInterface(ServerSideSessionInterface(session_store))
+hasher = PasswordHasher(rounds=int(os.environ.get('BCRYPT_ROUNDS', 12)), max_workers=int(os.environ.get('BCRYPT_WORKERS', 2)), max_pending=int(os.environ.get('BCRYPT_MAX_PENDING', 16)))
+users = UserCache(db, max_size=int(os.environ.get('USER_CACHE_SIZE', 1024)), ttl=float(os.environ.get('USER_CACHE_TTL', 300)))
+# Fan-out for GET /tasks/events; each stream queues at most SSE_MAX_EVENTS before it is told to resync
+events = EventHub(max_events=int(os.environ.get('SSE_MAX_EVENTS', 256)), max_subscriptions_per_user=int(os.environ.get('SSE_MAX_STREAMS_PER_USER', 32)))
+
+MAX_PAGE_SIZE = 500
+MAX_BATCH_SIZE = 1000
+MAX_SEARCH_TERMS = 16
+# Unpaginated listings longer than this are streamed instead of built in one piece
+STREAM_THRESHOLD = 1000
+# Idle event streams send a comment this often, which is also how closed connections are noticed
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15))
+# With SQL_TRACE on, requests running more statements than this (or repeating one) are logged
+SQL_QUERY_WARN = int(os.environ.get('SQL_QUERY_WARN', 20))
+
+request_queries = metrics.Histogram('queup_request_sql_queries', 'SQL statements executed per request.', ('route',), buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
 
 @atexit.register
 def cleanup_resources():
     print("Shutting down: Closing database connection")
+    events.close()
+    hasher.shutdown()
+    db.flush()
     db.close()
 
 def auth(f):
@@ -28,16 +108,132 @@ def auth(f):
         user_id = session.get('user_id')
         if not user_id:
             return jsonify({'error': 'Unauthorized'}), 401
-        user = db.get_user_by_id(user_id)
+        with metrics.phase("auth"):
+            user = users.get(user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
-        request.user_data = User(user['id'], db)
+        request.user_data = user
         return f(*args, **kwargs)
     return wrapper
 
+def encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> tuple:
+    value, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if not isinstance(task_id, str) or not (value is None or isinstance(value, str)):
+        raise ValueError("Invalid cursor")
+    return value, task_id
+
+def make_etag(user_id: int, version: int, valid_until: datetime = None) -> str:
+    """user-version-representation-expiry; the expiry lets a time-dependent response be revalidated without recomputing it"""
+    digest = hashlib.blake2b(request.full_path.encode('utf-8'), digest_size=8).hexdigest()
+    expiry = to_micros(valid_until) if valid_until else 'inf'
+    return f'{user_id}-{version}-{digest}-{expiry}'
+
+def etag_still_valid(etag: str, prefix: str) -> bool:
+    if not etag.startswith(prefix):
+        return False
+    expiry = etag[len(prefix):]
+    return expiry == 'inf' or (expiry.isdigit() and to_micros(datetime.now()) < int(expiry))
+
+def conditional(f):
+    """ETag/If-None-Match for GET routes. Answers 304 from the user's version alone, before auth
+    loads the user; routes whose output depends on the clock set g.etag_valid_until."""
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        user_id = session.get('user_id')
+        version = db.get_user_version(user_id) if user_id else None
+        if version is None:
+            return f(*args, **kwargs)
+        
+        prefix = make_etag(user_id, version).rsplit('-', 1)[0] + '-'
+        for etag in request.if_none_match.as_set():
+            if etag_still_valid(etag, prefix):
+                response = Response(status=304)
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'private, no-cache'
+                return response
+        
+        response = make_response(f(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            response.set_etag(make_etag(user_id, version, g.get('etag_valid_until')))
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
+
 @app.teardown_appcontext
 def cleanup_after_request(exception=None):
-    pass
+    db.release()
+
+@app.before_request
+def start_query_trace():
+    if tracer is not None:
+        tracer.begin()
+
+@app.after_request
+def record_request_latency(response):
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    start = request.environ.get('queup.request_start')
+    if start is not None:
+        metrics.request_duration.observe(time.perf_counter() - start, route, request.method, response.status_code)
+    stats = tracer.end() if tracer is not None else None
+    if stats is not None:
+        request_queries.observe(stats.queries, route)
+        response.headers['X-SQL-Queries'] = str(stats.queries)
+        repeated = stats.repeated(3)
+        if stats.queries > SQL_QUERY_WARN or repeated:
+            app.logger.warning("%s %s ran %d SQL statements (%d rows read, %d written, %.1f ms); repeated: %s",
+                               request.method, request.path, stats.queries, stats.rows_read, stats.rows_written, stats.seconds * 1000, repeated or '-')
+    return response
+
+@metrics.register_collector
+def user_cache_metrics():
+    stats = users.stats()
+    return [
+        ('queup_user_cache_size', 'gauge', 'Hydrated users currently cached.', stats['size']),
+        ('queup_user_cache_hits_total', 'counter', 'User cache hits.', stats['hits']),
+        ('queup_user_cache_misses_total', 'counter', 'User cache misses.', stats['misses']),
+        ('queup_user_cache_evictions_total', 'counter', 'User cache evictions.', stats['evictions']),
+        ('queup_user_cache_revalidations_total', 'counter', 'Cached users checked against users.version after another connection or process committed.', stats['revalidations']),
+        ('queup_user_cache_stale_total', 'counter', 'Cached users reloaded because they were changed elsewhere.', stats['stale'])
+    ]
+
+@metrics.register_collector
+def sql_metrics():
+    if tracer is None:
+        return []
+    totals = tracer.totals
+    return [
+        ('queup_sql_queries_total', 'counter', 'SQL statements executed.', totals.queries),
+        ('queup_sql_seconds_total', 'counter', 'Time spent executing SQL statements.', totals.seconds),
+        ('queup_sql_rows_read_total', 'counter', 'Rows fetched from SQL statements.', totals.rows_read),
+        ('queup_sql_rows_written_total', 'counter', 'Rows changed by SQL statements.', totals.rows_written),
+        ('queup_sql_slow_queries_total', 'counter', 'SQL statements slower than SQL_SLOW_MS.', tracer.slow_queries)
+    ]
+
+@metrics.register_collector
+def event_metrics():
+    stats = events.stats()
+    return [
+        ('queup_event_streams', 'gauge', 'Open /tasks/events streams.', stats['connections']),
+        ('queup_event_stream_users', 'gauge', 'Users with at least one open event stream.', stats['users']),
+        ('queup_events_published_total', 'counter', 'Task events delivered to at least one stream.', stats['published'])
+    ]
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def hash_password(password: str) -> str:
+    """hasher.hash, unless asgi.py already awaited this hash on the event loop (its Future is then settled or timed out)"""
+    future = request.environ.get('queup.password_hashes', {}).get(password)
+    return future.result(0) if future is not None else hasher.hash(password)
+
+def check_password(password: str, hashed: str) -> bool:
+    """hasher.verify, unless asgi.py already awaited this check on the event loop"""
+    future = request.environ.get('queup.password_checks', {}).get((password, hashed))
+    return future.result(0) if future is not None else hasher.verify(password, hashed)
 
 @app.route('/register', methods=['POST'])
 def register():
@@ -45,20 +241,22 @@ def register():
     email = data.get('email')
     if not email:
         return jsonify({'error': 'Email is required'}), 400
-    if db.get_user_by_email(email):
-        return jsonify({'error': 'Email already exists'}), 400
     username = data.get('username')
     if not username:
         return jsonify({'error': 'Username is required'}), 400
-    if db.get_user(username):
-        return jsonify({'error': 'Username already exists'}), 400
     password = data.get('password')
     if not password:
         return jsonify({'error': 'Password is required'}), 400
     if len(password) < 8:
         return jsonify({'error': 'Password must be at least 8 characters long'}), 400
     
-    db.add_user(username, bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'), email)
+    try:
+        hashed = hash_password(password)
+    except (HasherBusy, FutureTimeoutError):
+        return jsonify({'error': 'Server busy, please try again shortly'}), 503
+    result = db.add_user(username, hashed, email)
+    if not result['success']:
+        return jsonify({'error': result['response']}), 400
     return jsonify({'message': 'User registered successfully'}), 201
 
 @app.route('/login', methods=['POST'])
@@ -67,15 +265,20 @@ def login():
     username = data.get('username')
     if not username:
         return jsonify({'error': 'Username is required'}), 400
-    if not db.get_user(username):
-        return jsonify({'error': 'Username does not exist'}), 404
     password = data.get('password')
     if not password:
         return jsonify({'error': 'Password is required'}), 400
     
     user = db.get_user(username)
-    if not user or not bcrypt.checkpw(password.encode('utf-8'), user['password'].encode('utf-8')):
-        return jsonify({'error': 'Invalid username or password'}), 401
+    if not user:
+        return jsonify({'error': 'Username does not exist'}), 404
+    try:
+        if not check_password(password, user['password']):
+            return jsonify({'error': 'Invalid username or password'}), 401
+        if hasher.needs_rehash(user['password']):
+            db.update_user(username, password=hash_password(password))
+    except (HasherBusy, FutureTimeoutError):
+        return jsonify({'error': 'Server busy, please try again shortly'}), 503
     
     session['user_id'] = user['id']
     return jsonify({'message': 'Login successful'}), 200
@@ -97,73 +300,307 @@ def me():
     return jsonify({'id': user['id'], 'username': user['username'], 'email': user['email']}), 200
 
 @app.route('/tasks', methods=['GET'])
+@conditional
 @auth
-def get_tasks():    
+def get_tasks():
     try:
-        tasks = request.user_data.get_prioritized_tasks()
-        urgent_tasks_list = request.user_data.get_urgent_tasks()
-        overdue_tasks_list = request.user_data.get_overdue_tasks()
-
-        overdue_tasks = [task for task in tasks if task in overdue_tasks_list]
-        urgent_tasks = [task for task in tasks if task in urgent_tasks_list and task not in overdue_tasks_list]
-        prioritized_tasks = [task for task in tasks if task not in urgent_tasks_list and task not in overdue_tasks_list]
+        task_filter = task_filter_from_args()
+    except ValueError:
+        return jsonify({'error': 'Invalid date in filter'}), 400
+    
+    try:
+        buckets = request.user_data.partition_tasks(task_filter=task_filter)
+        g.etag_valid_until = request.user_data.next_priority_change()
         
-        tasks_data = {
-            "overdue": [{'id': task.id, 'title': task.title, 'category': task.category, 'type': task.type, 'difficulty': task.difficulty, 'note': task.note, 'due': task.due.isoformat() if task.due else None, 'deadline': task.deadline.isoformat() if task.deadline else None, 'complete': task.complete} for task in overdue_tasks],
-            "urgent": [{'id': task.id, 'title': task.title, 'category': task.category, 'type': task.type, 'difficulty': task.difficulty, 'note': task.note, 'due': task.due.isoformat() if task.due else None, 'deadline': task.deadline.isoformat() if task.deadline else None, 'complete': task.complete} for task in urgent_tasks],
-            "prioritized": [{'id': task.id, 'title': task.title, 'category': task.category, 'type': task.type, 'difficulty': task.difficulty, 'note': task.note, 'due': task.due.isoformat() if task.due else None, 'deadline': task.deadline.isoformat() if task.deadline else None, 'complete': task.complete} for task in prioritized_tasks]
-        }
+        tasks_data = {bucket: [task_to_dict(task) for task in tasks] for bucket, tasks in buckets.items()}
         
         return jsonify(tasks_data), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/tasks/completed', methods=['GET'])
+@conditional
 @auth
 def get_completed_tasks():
+    """Without parameters returns every completed task as a list. ?limit=&after= pages through them
+    newest first (?order=completed|deadline), and ?format=ndjson streams the full history.
+    Accepts the same filters as GET /tasks."""
+    order = request.args.get('order', 'completed')
+    if order not in ('completed', 'deadline'):
+        return jsonify({'error': 'Order must be completed or deadline'}), 400
+    limit = request.args.get('limit')
+    after = request.args.get('after')
     try:
-        completed_tasks = request.user_data.get_completed_tasks()
-        tasks_data = [{'id': task.id, 'title': task.title, 'category': task.category, 'type': task.type, 'difficulty': task.difficulty, 'note': task.note, 'due': task.due.isoformat() if task.due else None, 'deadline': task.deadline.isoformat() if task.deadline else None, 'complete': task.complete} for task in completed_tasks]
-        return jsonify(tasks_data), 200
+        task_filter = task_filter_from_args()
+    except ValueError:
+        return jsonify({'error': 'Invalid date in filter'}), 400
+    
+    try:
+        if request.args.get('format') == 'ndjson':
+            tasks = db.iter_completed_tasks(request.user_data.user_id, order, task_filter=task_filter)
+            return Response(stream_with_context(iter_ndjson(tasks)), mimetype='application/x-ndjson'), 200
+        
+        if limit is None and after is None:
+            if task_filter:
+                completed_tasks = list(db.iter_completed_tasks(request.user_data.user_id, order, task_filter=task_filter))
+            else:
+                completed_tasks = request.user_data.get_completed_tasks()
+            if len(completed_tasks) > STREAM_THRESHOLD:
+                return Response(iter_json_array(completed_tasks), mimetype='application/json'), 200
+            return jsonify([task_to_dict(task) for task in completed_tasks]), 200
+        
+        try:
+            limit = min(max(int(limit or MAX_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+            after_key = decode_cursor(after) if after else None
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid limit or cursor'}), 400
+        
+        tasks = db.get_completed_tasks_page(request.user_data.user_id, limit + 1, after_key, order, task_filter)
+        next_cursor = encode_cursor(completed_task_key(tasks[limit - 1], order)) if len(tasks) > limit else None
+        return jsonify({'tasks': [task_to_dict(task) for task in tasks[:limit]], 'next': next_cursor}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def parse_filter_bound(name: str, end_of_day: bool = False) -> datetime:
+    value = request.args.get(name)
+    if not value:
+        return None
+    bound = datetime.fromisoformat(value)
+    if bound.tzinfo is not None:
+        bound = bound.astimezone().replace(tzinfo=None)
+    if end_of_day and len(value) == 10:
+        # A bare date as the upper bound includes that whole day
+        bound = bound.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return bound
+
+def task_filter_from_args() -> TaskFilter:
+    """?category=&type=&difficulty= (repeatable) and ?deadline_from=&deadline_to=&due_from=&due_to= (ISO date or datetime)"""
+    return TaskFilter(
+        categories=request.args.getlist('category'),
+        types=request.args.getlist('type'),
+        difficulties=request.args.getlist('difficulty'),
+        deadline_from=parse_filter_bound('deadline_from'),
+        deadline_to=parse_filter_bound('deadline_to', end_of_day=True),
+        due_from=parse_filter_bound('due_from'),
+        due_to=parse_filter_bound('due_to', end_of_day=True)
+    )
+
+@app.route('/tasks/search', methods=['GET'])
+@conditional
+@auth
+def search_tasks():
+    """?q= words matched as prefixes against titles and notes, best match first; ?limit=&offset= page the results"""
+    terms = re.findall(r'\w+', request.args.get('q', ''))
+    if not terms:
+        return jsonify({'error': 'Search query is required'}), 400
+    if not db.search_enabled:
+        return jsonify({'error': 'Search is not available'}), 501
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), MAX_PAGE_SIZE)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or offset'}), 400
+    
+    try:
+        tasks = db.search_tasks(request.user_data.user_id, terms[:MAX_SEARCH_TERMS], limit + 1, offset)
+        next_offset = offset + limit if len(tasks) > limit else None
+        return jsonify({'tasks': [task_to_dict(task) for task in tasks[:limit]], 'next': next_offset}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+TRANSITION_EVENTS = {'urgent': 'became-urgent', 'overdue': 'became-overdue'}
+
+def completion_event(task) -> dict:
+    return {'id': task.id, 'complete': task.complete, 'completed_at': task.iso('completed_at')}
+
+def encode_transitions(transitions: list[tuple]) -> list[bytes]:
+    return [encode_event(TRANSITION_EVENTS[kind], {'id': task_id, 'at': at.isoformat()}) for kind, task_id, at in transitions]
+
+def transition_frames(user_id: int, since: datetime, until: datetime) -> list[bytes]:
+    """Events for tasks that turned urgent or overdue in (since, until]; streams don't hold a pooled connection between checks"""
+    try:
+        return encode_transitions(db.get_transitions(user_id, since, until))
+    finally:
+        db.release()
+
+def next_transition(user_id: int, now: datetime) -> datetime:
+    try:
+        return db.next_transition(now, user_id)
+    finally:
+        db.release()
+
+def user_version(user_id: int) -> int:
+    try:
+        return db.get_user_version(user_id)
+    finally:
+        db.release()
+
+def stream_events(subscription, checked: datetime):
+    """Wait for published events, the user's next urgency transition or the heartbeat, whichever comes first"""
+    user_id = subscription.user_id
+    try:
+        yield b'retry: 5000\n\n'
+        next_at = next_transition(user_id, checked)
+        while True:
+            timeout = SSE_HEARTBEAT
+            if next_at is not None:
+                timeout = min(timeout, max(0.0, (next_at - datetime.now()).total_seconds()))
+            frames = subscription.get(timeout)
+            if frames is None:
+                return
+            now = datetime.now()
+            if frames or (next_at is not None and now >= next_at):
+                # Changes can move the next transition, so look again after any event
+                frames += transition_frames(user_id, checked, now)
+                checked = now
+                next_at = next_transition(user_id, now)
+            if subscription.catch_up(user_version(user_id)):
+                # Changed by another worker process, whose events this hub never sees
+                frames.append(RESYNC)
+                next_at = next_transition(user_id, now)
+            yield b''.join(frames) if frames else HEARTBEAT
+    finally:
+        events.unsubscribe(subscription)
+
+@app.route('/tasks/events', methods=['GET'])
+@auth
+def task_events():
+    """Server-Sent Events stream of the user's task changes: added, completed, deleted, became-urgent
+    and became-overdue, plus resync when the client should refetch /tasks instead"""
+    subscription = events.subscribe(request.user_data.user_id, request.user_data.version)
+    if subscription is None:
+        return jsonify({'error': 'Too many open event streams'}), 429
+    if 'queup.asgi' in request.environ:
+        # Under asgi.py the event loop streams the subscription itself, without holding this worker thread
+        request.environ['queup.event_stream'] = subscription
+        body = iter(())
+    else:
+        body = stream_events(subscription, datetime.now())
+    response = Response(body, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def validate_task_data(data, user: User):
+    """Return (error, status) for the first missing or invalid field of a new task, or None if it is valid"""
+    if not isinstance(data, dict):
+        return 'Task must be an object', 400
+    if not data.get('title'):
+        return 'Title is required', 400
+    if not data.get('category'):
+        return 'Category is required', 400
+    if not data.get('type'):
+        return 'Type is required', 400
+    if not user.get_task_type_setting(data['type']):
+        return 'Invalid task type', 404
+    if not data.get('difficulty'):
+        return 'Difficulty is required', 400
+    if not user.get_difficulty_setting(data['difficulty']):
+        return 'Invalid task difficulty', 404
+    if not data.get('deadline'):
+        return 'Deadline is required', 400
+    return None
+
 @app.route('/tasks', methods=['POST'])
 @auth
 def add_task():    
     data = request.get_json()
-    title = data.get('title')
-    if not title:
-        return jsonify({'error': 'Title is required'}), 400
-    category = data.get('category')
-    if not category:
-        return jsonify({'error': 'Category is required'}), 400
-    typee = data.get('type')
-    if not typee:
-        return jsonify({'error': 'Type is required'}), 400
-    task_type = request.user_data.get_task_type_setting(typee)
-    if not task_type:
-        return jsonify({'error': 'Invalid task type'}), 404
-    difficulty = data.get('difficulty')
-    if not difficulty:
-        return jsonify({'error': 'Difficulty is required'}), 400
-    difficulty_setting = request.user_data.get_difficulty_setting(difficulty)
-    if not difficulty_setting:
-        return jsonify({'error': 'Invalid task difficulty'}), 404
-    note = data.get('note', '')
-    deadline = data.get('deadline')
-    if not deadline:
-        return jsonify({'error': 'Deadline is required'}), 400
+    invalid = validate_task_data(data, request.user_data)
+    if invalid:
+        return jsonify({'error': invalid[0]}), invalid[1]
     
     try:
-        result = request.user_data.add_task(title, category, typee, deadline, difficulty, note)
+        task = request.user_data.build_task(data['title'], data['category'], data['type'], data['deadline'], data['difficulty'], data.get('note', ''))
+        result = request.user_data.add_tasks([task])
         if result['success']:
-            return jsonify({'message': 'Task added successfully'}), 201
+            events.publish(request.user_data.user_id, 'added', task_to_dict(task), result.get('version'))
+            return jsonify({'message': 'Task added successfully', 'id': task.id}), 201
         else:
             return jsonify({'error': result['response']}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@app.route('/tasks/batch', methods=['POST'])
+@auth
+def add_tasks_batch():
+    """Add up to MAX_BATCH_SIZE tasks in one transaction; invalid items are reported and skipped"""
+    data = request.get_json()
+    items = data.get('tasks') if isinstance(data, dict) else None
+    if not items or not isinstance(items, list):
+        return jsonify({'error': 'Tasks must be a non-empty list'}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} tasks per batch'}), 400
     
+    try:
+        results = []
+        tasks = []
+        for item in items:
+            invalid = validate_task_data(item, request.user_data)
+            if invalid:
+                results.append({'success': False, 'error': invalid[0]})
+                continue
+            try:
+                task = request.user_data.build_task(item['title'], item['category'], item['type'], item['deadline'], item['difficulty'], item.get('note', ''))
+            except (TypeError, ValueError) as e:
+                results.append({'success': False, 'error': str(e)})
+                continue
+            tasks.append(task)
+            results.append({'success': True, 'id': task.id})
+        
+        if tasks:
+            result = request.user_data.add_tasks(tasks)
+            if not result['success']:
+                return jsonify({'error': result['response']}), 400
+            if events.watching(request.user_data.user_id):
+                for task in tasks:
+                    events.publish(request.user_data.user_id, 'added', task_to_dict(task), result.get('version'))
+        return jsonify({'added': len(tasks), 'results': results}), 201 if tasks else 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def batch_task_ids():
+    """Validate a {"ids": [...]} body; returns (ids, per-item results, existing ids) or an error response"""
+    data = request.get_json()
+    task_ids = data.get('ids') if isinstance(data, dict) else None
+    if not task_ids or not isinstance(task_ids, list):
+        return None, (jsonify({'error': 'Ids must be a non-empty list'}), 400)
+    if len(task_ids) > MAX_BATCH_SIZE:
+        return None, (jsonify({'error': f'At most {MAX_BATCH_SIZE} ids per batch'}), 400)
+    
+    results = []
+    existing = []
+    seen = set()
+    known_ids = {task.id for task in request.user_data.get_tasks()}
+    for task_id in task_ids:
+        if not isinstance(task_id, str) or task_id not in known_ids:
+            results.append({'id': task_id, 'success': False, 'error': 'Task not found'})
+        elif task_id in seen:
+            results.append({'id': task_id, 'success': False, 'error': 'Duplicate id'})
+        else:
+            seen.add(task_id)
+            existing.append(task_id)
+            results.append({'id': task_id, 'success': True})
+    return (results, existing), None
+
+@app.route('/tasks/batch', methods=['DELETE'])
+@auth
+def delete_tasks_batch():
+    parsed, error = batch_task_ids()
+    if error:
+        return error
+    results, existing = parsed
+    
+    try:
+        if existing:
+            result = request.user_data.delete_tasks(existing)
+            if not result['success']:
+                return jsonify({'error': result['response']}), 400
+            for task_id in existing:
+                events.publish(request.user_data.user_id, 'deleted', {'id': task_id}, result.get('version'))
+        return jsonify({'deleted': len(existing), 'results': results}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/tasks/<task_id>', methods=['DELETE'])
 @auth
 def delete_task(task_id):
@@ -173,6 +610,7 @@ def delete_task(task_id):
             return jsonify({'error': 'Task not found'}), 404
         result = request.user_data.delete_task(task_id)
         if result['success']:
+            events.publish(request.user_data.user_id, 'deleted', {'id': task_id}, result.get('version'))
             return jsonify({'message': 'Task deleted successfully'}), 200
         else:
             return jsonify({'error': result['response']}), 400
@@ -188,6 +626,7 @@ def mark_task_complete(task_id):
             return jsonify({'error': 'Task not found'}), 404
         result = request.user_data.mark_complete(task_id, complete=not task.complete)
         if result['success']:
+            events.publish(request.user_data.user_id, 'completed', completion_event(task), result.get('version'))
             if task.complete:
                 return jsonify({'message': 'Task marked as complete'}), 200
             else:
@@ -197,13 +636,38 @@ def mark_task_complete(task_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/tasks/complete/batch', methods=['PUT'])
+@auth
+def mark_tasks_complete_batch():
+    """Unlike the single-task route this sets an explicit state ("complete", default true) instead of toggling"""
+    parsed, error = batch_task_ids()
+    if error:
+        return error
+    results, existing = parsed
+    complete = request.get_json().get('complete', True)
+    if not isinstance(complete, bool):
+        return jsonify({'error': 'Complete must be a boolean'}), 400
+    
+    try:
+        if existing:
+            result = request.user_data.mark_complete_many(existing, complete)
+            if not result['success']:
+                return jsonify({'error': result['response']}), 400
+            if events.watching(request.user_data.user_id):
+                for task in map(request.user_data.get_task_by_id, existing):
+                    events.publish(request.user_data.user_id, 'completed', completion_event(task), result.get('version'))
+        return jsonify({'updated': len(existing), 'results': results}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/settings', methods=['GET'])
+@conditional
 @auth
 def get_settings():
     try:
         settings = {
-            "task_types": [{"name": setting.name, "deadline_format": setting.deadline_format, "priority_rank": setting.priority_rank, "default_due_days_before_deadline": setting.default_due_days_before_deadline, "prioritize_when_days_left": setting.prioritize_when_days_left} for setting in request.user_data.get_task_type_settings()], 
-            "difficulties": [{"name": setting.name, "priority_rank": setting.priority_rank} for setting in request.user_data.get_difficulty_settings()]
+            "task_types": [task_type_setting_to_dict(setting) for setting in request.user_data.get_task_type_settings()], 
+            "difficulties": [difficulty_setting_to_dict(setting) for setting in request.user_data.get_difficulty_settings()]
         }
         return jsonify(settings), 200
     except Exception as e:
@@ -245,7 +709,9 @@ def update_settings():
             result = request.user_data.update_difficulty_settings(difficulty_settings)
             if not result['success']:
                 return jsonify({'error': result['response']}), 400
-                
+        
+        # Every task's urgency can change with the settings, so clients refetch rather than get deltas
+        events.publish(request.user_data.user_id, 'resync', {}, request.user_data.version)
         return jsonify({'message': 'Settings updated successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -267,7 +733,8 @@ def update_priority_order():
             updated_type_settings = []
             for index, type_name in enumerate(task_types_order):
                 if type_name in settings_dict:
-                    setting = settings_dict[type_name]
+                    # Settings belong to a shared scoring plan, so build new ones rather than mutate them
+                    setting = TaskTypeSettings(**task_type_setting_to_dict(settings_dict[type_name]))
                     setting.priority_rank = index  # Lower index = higher priority (lower rank)
                     updated_type_settings.append(setting)
             
@@ -284,7 +751,7 @@ def update_priority_order():
             updated_difficulty_settings = []
             for index, difficulty_name in enumerate(difficulties_order):
                 if difficulty_name in settings_dict:
-                    setting = settings_dict[difficulty_name]
+                    setting = DifficultySettings(**difficulty_setting_to_dict(settings_dict[difficulty_name]))
                     setting.priority_rank = index  # Lower index = higher priority (lower rank)
                     updated_difficulty_settings.append(setting)
             
@@ -293,6 +760,7 @@ def update_priority_order():
                 if not result['success']:
                     return jsonify({'error': f'Failed to update difficulties: {result["response"]}'}), 400
         
+        events.publish(request.user_data.user_id, 'resync', {}, request.user_data.version)
         return jsonify({'message': 'Priority order updated successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
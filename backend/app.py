@@ -1,10 +1,24 @@
 import sqlite3
 import json
 import uuid
+import queue
+import heapq
+import bisect
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+import serializers
+import metrics
+from serializers import task_type_setting_to_dict, difficulty_setting_to_dict
+from writer import GroupCommitWriter, RollbackWrite
+from scoring import ScoringPlan, to_micros, from_micros, score_one, next_score_change, transition_times
 
 
 class TaskTypeSettings:
+    __slots__ = ('name', 'default_due_days_before_deadline', 'prioritize_when_days_left', 'deadline_format', 'priority_rank')
+
     def __init__(self, name, default_due_days_before_deadline=1, prioritize_when_days_left=1, deadline_format="date", priority_rank=0):
         self.name = name
         self.default_due_days_before_deadline = default_due_days_before_deadline
@@ -13,21 +27,122 @@ class TaskTypeSettings:
         self.priority_rank = priority_rank
 
 class DifficultySettings:
+    __slots__ = ('name', 'priority_rank')
+
     def __init__(self, name, priority_rank=0):
         self.name = name
         self.priority_rank = priority_rank
 
+def parse_task_type_settings(settings_json) -> list[TaskTypeSettings]:
+    """Task type settings stored on a user row, or the defaults when there are none"""
+    if settings_json:
+        return [TaskTypeSettings(**setting) for setting in serializers.loads(settings_json)]
+    return [
+        TaskTypeSettings("Short term", 1, 1, "date", 0),
+        TaskTypeSettings("Long term", 7, 14, "date", 1)
+    ]
+
+def parse_difficulty_settings(settings_json) -> list[DifficultySettings]:
+    if settings_json:
+        return [DifficultySettings(**setting) for setting in serializers.loads(settings_json)]
+    return [
+        DifficultySettings("Easy", 2),
+        DifficultySettings("Medium", 1),
+        DifficultySettings("Hard", 0)
+    ]
+
+def task_type_settings_json(task_type_settings) -> str:
+    return json.dumps([task_type_setting_to_dict(setting) for setting in task_type_settings])
+
+def difficulty_settings_json(difficulty_settings) -> str:
+    return json.dumps([difficulty_setting_to_dict(setting) for setting in difficulty_settings])
+
+# Plans are shared by every user whose stored settings are identical (e.g. everyone still on the defaults)
+SCORING_PLAN_CACHE_SIZE = 1024
+_scoring_plans = OrderedDict()
+_scoring_plans_lock = threading.Lock()
+
+def scoring_plan(task_type_settings_json, difficulty_settings_json) -> ScoringPlan:
+    """Compiled plan for a user's stored settings JSON, cached under a hash of that JSON"""
+    digest = hashlib.blake2b(digest_size=16)
+    for settings_json in (task_type_settings_json, difficulty_settings_json):
+        if isinstance(settings_json, str):
+            settings_json = settings_json.encode('utf-8')
+        digest.update(settings_json or b'')
+        digest.update(b'\0')
+    key = digest.hexdigest()
+    with _scoring_plans_lock:
+        plan = _scoring_plans.get(key)
+        if plan is not None:
+            _scoring_plans.move_to_end(key)
+            return plan
+    plan = ScoringPlan(parse_task_type_settings(task_type_settings_json), parse_difficulty_settings(difficulty_settings_json), key)
+    with _scoring_plans_lock:
+        plan = _scoring_plans.setdefault(key, plan)
+        while len(_scoring_plans) > SCORING_PLAN_CACHE_SIZE:
+            _scoring_plans.popitem(last=False)
+    return plan
+
+class _LazyDatetime:
+    """Task datetime field kept as given (datetime or ISO string) and parsed on first read.
+    Assigning it also clears the cached epoch-microsecond form used for scoring."""
+    def __set_name__(self, owner, name):
+        self.raw = '_' + name
+        self.micros = '_' + name + '_us'
+
+    def __get__(self, task, owner=None):
+        if task is None:
+            return self
+        value = getattr(task, self.raw)
+        if value.__class__ is str:
+            value = datetime.fromisoformat(value)
+            setattr(task, self.raw, value)
+        return value
+
+    def __set__(self, task, value):
+        setattr(task, self.raw, value or None)
+        setattr(task, self.micros, None)
+
 class Task:
-    def __init__(self, title, category, type, due, deadline, difficulty=None, note=None, complete=False, id=None):
+    __slots__ = ('id', 'title', 'category', 'type', 'difficulty', 'note', 'complete',
+                 '_due', '_deadline', '_completed_at', '_due_us', '_deadline_us', '_completed_at_us')
+
+    due = _LazyDatetime()
+    deadline = _LazyDatetime()
+    completed_at = _LazyDatetime()
+
+    def __init__(self, title, category, type, due, deadline, difficulty=None, note=None, complete=False, id=None, completed_at=None):
         self.id = id if id else str(uuid.uuid4())
         self.title = title
         self.type = type
-        self.due = due if isinstance(due, datetime) else datetime.fromisoformat(due) if due else None
-        self.deadline = deadline if isinstance(deadline, datetime) else datetime.fromisoformat(deadline) if deadline else None
+        self.due = due
+        self.deadline = deadline
         self.category = category
         self.difficulty = difficulty
         self.note = note
         self.complete = complete
+        self.completed_at = completed_at
+
+    @property
+    def due_us(self) -> int:
+        """due as microseconds since the epoch (cached), or None"""
+        if self._due_us is None and self._due is not None:
+            self._due_us = to_micros(self.due)
+        return self._due_us
+
+    @property
+    def deadline_us(self) -> int:
+        """deadline as microseconds since the epoch (cached), or None"""
+        if self._deadline_us is None and self._deadline is not None:
+            self._deadline_us = to_micros(self.deadline)
+        return self._deadline_us
+
+    def iso(self, field: str) -> str:
+        """ISO string of due/deadline/completed_at without parsing a value that was loaded as a string"""
+        value = getattr(self, '_' + field)
+        if value is None or value.__class__ is str:
+            return value
+        return value.isoformat()
     
     def set_deadline_with_time_setting(self, deadline_input, format_type: str = "date"):
         if isinstance(deadline_input, str):
@@ -38,13 +153,150 @@ class Task:
         else:
             self.deadline = deadline_input.replace(hour=23, minute=59, second=59, microsecond=0)
 
+def completed_task_key(task: Task, order: str = "completed") -> tuple:
+    """Keyset position of a task in database.get_completed_tasks_page"""
+    return (task.iso("completed_at" if order == "completed" else "deadline"), task.id)
+
+class TaskFilter:
+    """Server-side task filters (exact category/type/difficulty, inclusive deadline/due ranges), evaluated in SQL"""
+    __slots__ = ('categories', 'types', 'difficulties', 'deadline_from', 'deadline_to', 'due_from', 'due_to')
+
+    def __init__(self, categories: list[str] = (), types: list[str] = (), difficulties: list[str] = (), deadline_from: datetime = None, deadline_to: datetime = None, due_from: datetime = None, due_to: datetime = None):
+        self.categories = list(categories)
+        self.types = list(types)
+        self.difficulties = list(difficulties)
+        self.deadline_from = deadline_from
+        self.deadline_to = deadline_to
+        self.due_from = due_from
+        self.due_to = due_to
+
+    def __bool__(self):
+        return any(getattr(self, name) for name in self.__slots__)
+
+    def sql(self) -> tuple[str, list]:
+        """' AND ...' conditions on the tasks table and their parameters"""
+        conditions = []
+        params = []
+        for column, values in (('category', self.categories), ('type', self.types), ('difficulty', self.difficulties)):
+            if values:
+                conditions.append(f'{column} IN ({", ".join("?" * len(values))})')
+                params.extend(values)
+        # ISO strings of naive datetimes sort chronologically, so ranges use the (user_id, deadline/due) indexes
+        for column, low, high in (('deadline', self.deadline_from, self.deadline_to), ('due', self.due_from, self.due_to)):
+            if low is not None:
+                conditions.append(f'{column} >= ?')
+                params.append(low.isoformat())
+            if high is not None:
+                conditions.append(f'{column} <= ?')
+                params.append(high.isoformat())
+        return ''.join(f' AND {condition}' for condition in conditions), params
+
 class database:
-    def __init__(self, db_name: str):
-        self.connection = sqlite3.connect(db_name, check_same_thread=False)
+    def __init__(self, db_name: str, pool_size: int = 8, busy_timeout: float = 5.0, cache_size_kb: int = 8192, mmap_size: int = 64 * 1024 * 1024, tracer=None,
+                 group_commit: bool = False, commit_delay: float = 0.005, commit_batch: int = 64, max_pending_writes: int = 1024, commit_timeout: float = 30.0):
+        """pool_size=0 keeps a single connection shared by all threads (always the case for :memory:);
+        tracer is an optional sqltrace.QueryTracer that instruments every cursor;
+        group_commit hands writes to a writer thread that commits up to commit_batch of them together
+        (waiting at most commit_delay seconds for more), with at most max_pending_writes queued;
+        a write not committed within commit_timeout seconds raises sqlite3.OperationalError"""
+        self.db_name = db_name
+        self.tracer = tracer
+        self.pool_size = pool_size if db_name != ":memory:" else 0
+        self.busy_timeout = busy_timeout
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        self._shared = None
+        self._data_versions = {}
+        self._generation = 0
+        if not self.pool_size:
+            self._shared = self._connect()
+            self._connections.append(self._shared)
+        self._writer = None
         self._create_tables()
+        self.release()
+        if group_commit:
+            if not self.pool_size:
+                raise ValueError("group_commit needs a file database with a connection pool")
+            self._writer = GroupCommitWriter(self._connect, tracer.wrap if tracer is not None else None, commit_batch, commit_delay, max_pending_writes,
+                                             result_timeout=commit_timeout)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_name, timeout=self.busy_timeout, check_same_thread=False)
+        if self.db_name != ":memory:":
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(f'PRAGMA busy_timeout={int(self.busy_timeout * 1000)}')
+        connection.execute(f'PRAGMA cache_size={-int(self.cache_size_kb)}')
+        connection.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        return connection
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            if len(self._connections) < self.pool_size:
+                connection = self._connect()
+                self._connections.append(connection)
+                return connection
+        try:
+            return self._idle.get(timeout=self.busy_timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Database connection pool exhausted")
+
+    @property
+    def connection(self):
+        """The connection bound to the current thread, checked out of the pool on first use"""
+        if self._shared is not None:
+            return self._shared
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._checkout()
+            self._local.connection = connection
+        return connection
+
+    def release(self):
+        """Return the current thread's connection to the pool (called at the end of each request)"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            return
+        self._local.connection = None
+        if connection.in_transaction:
+            connection.rollback()
+        self._idle.put(connection)
         
     def get_cursor(self):
-        return self.connection.cursor()
+        cursor = self.connection.cursor()
+        return self.tracer.wrap(cursor) if self.tracer is not None else cursor
+
+    def _write(self, fn, wait: bool = True):
+        """Run fn(cursor) as one atomic write and return its result; fn raises RollbackWrite to undo
+        its changes and return a result anyway. With group commit, fn runs on the writer thread and
+        wait=False returns without waiting for the commit."""
+        if self._writer is not None:
+            future = self._writer.submit(fn)
+            return self._writer.result(future) if wait else None
+        cursor = self.get_cursor()
+        try:
+            result = fn(cursor)
+        except RollbackWrite as e:
+            self.connection.rollback()
+            return e.result
+        except BaseException:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+        return result
+
+    def flush(self):
+        """Wait until every queued group-commit write is committed"""
+        if self._writer is not None:
+            self._writer.flush()
 
     def _create_tables(self):
         cursor = self.get_cursor()
@@ -58,12 +310,189 @@ class database:
                 task_types TEXT,
                 task_difficulties TEXT,
                 task_type_settings TEXT,
-                difficulty_settings TEXT
+                difficulty_settings TEXT,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        self._add_missing_columns(cursor, 'users', {'version': 'INTEGER NOT NULL DEFAULT 0'})
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                category TEXT,
+                type TEXT,
+                difficulty TEXT,
+                note TEXT,
+                due TEXT,
+                deadline TEXT,
+                complete INTEGER NOT NULL DEFAULT 0,
+                completed_at TEXT,
+                urgent_from_us INTEGER,
+                overdue_at_us INTEGER,
+                PRIMARY KEY (user_id, id)
             )
         ''')
+        added = self._add_missing_columns(cursor, 'tasks', {'completed_at': 'TEXT', 'urgent_from_us': 'INTEGER', 'overdue_at_us': 'INTEGER'})
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_complete ON tasks (user_id, complete)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_deadline ON tasks (user_id, deadline)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_due ON tasks (user_id, due)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_category ON tasks (user_id, category)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_type ON tasks (user_id, type)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_difficulty ON tasks (user_id, difficulty)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_completed_at ON tasks (user_id, complete, completed_at, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_completed_deadline ON tasks (user_id, complete, deadline, id)')
+        # Transition timeline of incomplete tasks: per user for urgent/overdue range queries, server-wide for the next transition
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_urgent_from ON tasks (user_id, urgent_from_us) WHERE complete = 0')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_overdue_at ON tasks (user_id, overdue_at_us) WHERE complete = 0')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_urgent_from ON tasks (urgent_from_us) WHERE complete = 0')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_overdue_at ON tasks (overdue_at_us) WHERE complete = 0')
+        self._create_session_table(cursor)
+        self.search_enabled = self._create_search_index(cursor)
+        self._migrate_task_blobs(cursor)
+        if 'overdue_at_us' in added:
+            cursor.execute('SELECT username FROM users')
+            for (username,) in cursor.fetchall():
+                self._recompute_transitions(cursor, username)
         self.connection.commit()
+
+    @staticmethod
+    def _create_session_table(cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)')
+
+    @staticmethod
+    def _create_search_index(cursor) -> bool:
+        """FTS5 index over task titles and notes, kept in sync by triggers; False when SQLite lacks FTS5.
+
+        It is an external-content table reading from tasks by rowid. user_id is indexed too,
+        so a user's search is one posting-list intersection rather than a filter over every
+        user's matches.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'tasks_fts'")
+        exists = cursor.fetchone() is not None
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+                    user_id, title, note,
+                    content='tasks', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            return False
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+                INSERT INTO tasks_fts (rowid, user_id, title, note) VALUES (new.rowid, new.user_id, new.title, new.note);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+                INSERT INTO tasks_fts (tasks_fts, rowid, user_id, title, note) VALUES ('delete', old.rowid, old.user_id, old.title, old.note);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF user_id, title, note ON tasks BEGIN
+                INSERT INTO tasks_fts (tasks_fts, rowid, user_id, title, note) VALUES ('delete', old.rowid, old.user_id, old.title, old.note);
+                INSERT INTO tasks_fts (rowid, user_id, title, note) VALUES (new.rowid, new.user_id, new.title, new.note);
+            END
+        ''')
+        if not exists:
+            # Title matches outweigh note matches; the user_id column never contributes to the rank
+            cursor.execute("INSERT INTO tasks_fts (tasks_fts, rank) VALUES ('rank', 'bm25(0.0, 10.0, 1.0)')")
+            cursor.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+        return True
+
+    def rebuild_search_index(self):
+        """Re-read the whole search index from tasks (needed after a VACUUM, which may renumber rowids)"""
+        self._write(lambda cursor: cursor.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')"))
+
+    def search_tasks(self, user_id: int, terms: list[str], limit: int, offset: int = 0) -> list[Task]:
+        """The user's tasks whose title or note contain every term (as a word prefix), best BM25 match first"""
+        # The column filter keeps the terms off user_id, where "1" would otherwise match every task of user 1
+        match = ' '.join('"' + term.replace('"', '""') + '"*' for term in terms)
+        cursor = self.get_cursor()
+        cursor.execute('''
+            SELECT t.id, t.title, t.category, t.type, t.difficulty, t.note, t.due, t.deadline, t.complete, t.completed_at
+            FROM (
+                SELECT rowid, rank FROM tasks_fts WHERE tasks_fts MATCH ? ORDER BY rank, rowid LIMIT ? OFFSET ?
+            ) AS hit JOIN tasks t ON t.rowid = hit.rowid
+            WHERE t.user_id = ?
+            ORDER BY hit.rank, hit.rowid
+        ''', (f'user_id:{int(user_id)} AND {{title note}}: ({match})', limit, offset, user_id))
+        return [self._row_to_task(row) for row in cursor.fetchall()]
+
+    @staticmethod
+    def _add_missing_columns(cursor, table: str, columns: dict) -> set:
+        """Add columns introduced after the table was first created; returns the names added"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        added = set()
+        for name, definition in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+                added.add(name)
+        return added
+
+    def _migrate_task_blobs(self, cursor):
+        """Move tasks stored in the legacy users.tasks JSON column into the tasks table"""
+        cursor.execute('SELECT id, tasks, task_type_settings FROM users WHERE tasks IS NOT NULL')
+        for user_id, tasks_json, settings_json in cursor.fetchall():
+            tasks = [Task(**task_data) for task_data in json.loads(tasks_json)] if tasks_json else []
+            type_table = self._compile_type_settings(settings_json)
+            cursor.executemany('''
+                INSERT OR IGNORE INTO tasks (id, user_id, title, category, type, difficulty, note, due, deadline, complete, completed_at, urgent_from_us, overdue_at_us)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(task.id, user_id, *self._task_values(task), *transition_times(task.type, task.deadline_us, type_table)) for task in tasks])
+            cursor.execute('UPDATE users SET tasks = NULL WHERE id = ?', (user_id,))
+
+    @staticmethod
+    def _task_values(task: Task):
+        return (
+            task.title,
+            task.category,
+            task.type,
+            task.difficulty,
+            task.note,
+            task.iso('due'),
+            task.iso('deadline'),
+            1 if task.complete else 0,
+            task.iso('completed_at')
+        )
+
+    @staticmethod
+    def _compile_type_settings(settings_json) -> dict:
+        return scoring_plan(settings_json, None).type_table
+
+    def _user_type_table(self, cursor, username: str) -> dict:
+        """Compiled task type settings of a user, which the stored transition times derive from"""
+        cursor.execute('SELECT task_type_settings FROM users WHERE username = ?', (username,))
+        row = cursor.fetchone()
+        return self._compile_type_settings(row[0] if row else None)
+
+    def _recompute_transitions(self, cursor, username: str):
+        """Rewrite urgent_from_us/overdue_at_us of all the user's tasks from their current task type settings"""
+        type_table = self._user_type_table(cursor, username)
+        cursor.execute('''
+            SELECT t.user_id, t.id, t.type, t.deadline FROM tasks t JOIN users u ON u.id = t.user_id WHERE u.username = ?
+        ''', (username,))
+        rows = cursor.fetchall()
+        cursor.executemany('UPDATE tasks SET urgent_from_us = ?, overdue_at_us = ? WHERE user_id = ? AND id = ?', [
+            (*transition_times(task_type, to_micros(datetime.fromisoformat(deadline)) if deadline else None, type_table), user_id, task_id)
+            for user_id, task_id, task_type, deadline in rows
+        ])
+
+    @staticmethod
+    def _row_to_task(row):
+        return Task(row[1], row[2], row[3], row[6], row[7], row[4], row[5], bool(row[8]), row[0], row[9])
     
-    def add_user(self, username: str, password: str, email: str):
+    def add_user(self, username: str, password: str, email: str, user_id: int = None):
+        """user_id is normally assigned here; a sharded deployment passes the one its directory allocated"""
         try:
             default_types = json.dumps(["Short term", "Long term"])
             default_difficulties = json.dumps(["Easy", "Medium", "Hard"])
@@ -71,14 +500,19 @@ class database:
             default_type_settings = json.dumps([{"name": "Short term", "default_due_days_before_deadline": 1, "prioritize_when_days_left": 1, "deadline_format": "date", "priority_rank": 0}, {"name": "Long term", "default_due_days_before_deadline": 7, "prioritize_when_days_left": 14, "deadline_format": "date", "priority_rank": 1}])
             default_difficulty_settings = json.dumps([{"name": "Easy", "priority_rank": 2}, {"name": "Medium", "priority_rank": 1}, {"name": "Hard", "priority_rank": 0}])
             
-            cursor = self.get_cursor()
-            cursor.execute('''
-                INSERT INTO users (username, password, email, task_types, task_difficulties, task_type_settings, difficulty_settings)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (username, password, email, default_types, default_difficulties, default_type_settings, default_difficulty_settings))
-            self.connection.commit()
-            return {"success": True, "response": "User added successfully."}
-        except sqlite3.IntegrityError:
+            def insert(cursor):
+                cursor.execute('''
+                    INSERT INTO users (id, username, password, email, task_types, task_difficulties, task_type_settings, difficulty_settings)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, username, password, email, default_types, default_difficulties, default_type_settings, default_difficulty_settings))
+                return {"success": True, "response": "User added successfully."}
+            return self._write(insert)
+        except sqlite3.IntegrityError as e:
+            # The UNIQUE constraints double as the existence check, so registration is a single insert
+            if 'users.email' in str(e):
+                return {"success": False, "response": "Email already exists"}
+            if 'users.username' in str(e):
+                return {"success": False, "response": "Username already exists"}
             return {"success": False, "response": "User already exists."}
         except sqlite3.Error as e:
             return {"success": False, "response": f"An error occurred: {e}"}
@@ -141,106 +575,258 @@ class database:
             }
         return None
     
-    def _update_user_tasks(self, username: str, tasks: list[Task]):
-        tasks_json = json.dumps([{
-            'id': task.id,
-            'title': task.title,
-            'category': task.category,
-            'type': task.type,
-            'difficulty': task.difficulty,
-            'note': task.note,
-            'due': task.due.isoformat() if task.due else None,
-            'deadline': task.deadline.isoformat() if task.deadline else None,
-            'complete': task.complete
-        } for task in tasks])
+    def _bump_version(self, cursor, username: str) -> int:
+        """Every write to a user's data bumps users.version, which ETags and cache coherence are derived from.
+        Writes report the new version in their result ("version"), read in the same transaction."""
+        cursor.execute('UPDATE users SET version = version + 1 WHERE username = ? RETURNING version', (username,))
+        rows = cursor.fetchall()
+        return rows[0][0] if rows else None
+    
+    def data_generation(self, user_id: int = None) -> int:
+        """A counter that moves whenever any pooled connection sees a commit it did not make itself,
+        from this process's other connections or from other processes (PRAGMA data_version).
+        While it stays put, nothing cached from the database can have gone stale.
+        user_id only matters to ShardedDatabase, where it picks the shard whose counter is returned."""
+        connection = self.connection
+        data_version = connection.execute('PRAGMA data_version').fetchone()[0]
+        if self._data_versions.get(connection) != data_version:
+            with self._pool_lock:
+                if self._data_versions.get(connection) != data_version:
+                    self._data_versions[connection] = data_version
+                    self._generation += 1
+        return self._generation
+
+    def get_user_version(self, user_id: int):
         cursor = self.get_cursor()
-        cursor.execute('UPDATE users SET tasks = ? WHERE username = ?', (tasks_json, username))
-        self.connection.commit()
+        cursor.execute('SELECT version FROM users WHERE id = ?', (user_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
     
     def add_task_to_user(self, username: str, task: Task):
-        user = self._get_user(username)
-        if user:
-            tasks = []
-            if user[4]:
-                tasks_data = json.loads(user[4])
-                tasks = [Task(**task_data) for task_data in tasks_data]
-            tasks.append(task)
-            self._update_user_tasks(username, tasks)
-            return {"success": True, "response": "Task added successfully."}
-        else:
-            return {"success": False, "response": "User not found."}
+        def insert(cursor):
+            type_table = self._user_type_table(cursor, username)
+            cursor.execute('''
+                INSERT INTO tasks (id, user_id, title, category, type, difficulty, note, due, deadline, complete, completed_at, urgent_from_us, overdue_at_us)
+                SELECT ?, id, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? FROM users WHERE username = ?
+            ''', (task.id, *self._task_values(task), *transition_times(task.type, task.deadline_us, type_table), username))
+            if not cursor.rowcount:
+                return {"success": False, "response": "User not found."}
+            return {"success": True, "response": "Task added successfully.", "version": self._bump_version(cursor, username)}
+        try:
+            return self._write(insert)
+        except sqlite3.Error as e:
+            return {"success": False, "response": f"An error occurred: {e}"}
+    
+    def get_tasks_by_user_id(self, user_id: int):
+        cursor = self.get_cursor()
+        cursor.execute('''
+            SELECT id, title, category, type, difficulty, note, due, deadline, complete, completed_at
+            FROM tasks WHERE user_id = ? ORDER BY rowid
+        ''', (user_id,))
+        return [self._row_to_task(row) for row in cursor.fetchall()]
+    
+    def get_task_ids(self, user_id: int, task_filter: TaskFilter, complete: bool = None) -> list[str]:
+        """Ids of the user's tasks matching task_filter (and the completion state, if given)"""
+        conditions, params = task_filter.sql()
+        query = 'SELECT id FROM tasks WHERE user_id = ?'
+        if complete is not None:
+            query += ' AND complete = ?'
+            params = [1 if complete else 0, *params]
+        cursor = self.get_cursor()
+        cursor.execute(query + conditions, (user_id, *params))
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_completed_tasks_page(self, user_id: int, limit: int, after: tuple = None, order: str = "completed", task_filter: TaskFilter = None):
+        """Completed tasks newest first by completion time or deadline, starting after the (value, id) key of the previous page"""
+        column = {"completed": "completed_at", "deadline": "deadline"}[order]
+        query = '''
+            SELECT id, title, category, type, difficulty, note, due, deadline, complete, completed_at
+            FROM tasks WHERE user_id = ? AND complete = 1
+        '''
+        params = [user_id]
+        if task_filter:
+            conditions, filter_params = task_filter.sql()
+            query += conditions
+            params.extend(filter_params)
+        if after is not None:
+            value, task_id = after
+            # NULLs sort last when descending, so they form the tail of the listing
+            if value is None:
+                query += f' AND {column} IS NULL AND id < ?'
+                params.append(task_id)
+            else:
+                query += f' AND (({column}, id) < (?, ?) OR {column} IS NULL)'
+                params.extend([value, task_id])
+        query += f' ORDER BY {column} DESC, id DESC LIMIT ?'
+        params.append(limit)
+        cursor = self.get_cursor()
+        cursor.execute(query, params)
+        return [self._row_to_task(row) for row in cursor.fetchall()]
     
+    def iter_completed_tasks(self, user_id: int, order: str = "completed", batch_size: int = 500, task_filter: TaskFilter = None):
+        """Yield every completed task in page order, fetching one keyset page at a time"""
+        after = None
+        while True:
+            tasks = self.get_completed_tasks_page(user_id, batch_size, after, order, task_filter)
+            yield from tasks
+            if len(tasks) < batch_size:
+                return
+            after = completed_task_key(tasks[-1], order)
+    
+    def get_urgent_task_ids(self, user_id: int, now: datetime) -> list[str]:
+        """Ids of incomplete tasks that are urgent at now (overdue ones included), in the order they became urgent"""
+        cursor = self.get_cursor()
+        cursor.execute('SELECT id FROM tasks WHERE user_id = ? AND complete = 0 AND urgent_from_us <= ? ORDER BY urgent_from_us', (user_id, to_micros(now)))
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_overdue_task_ids(self, user_id: int, now: datetime) -> list[str]:
+        """Ids of incomplete tasks whose deadline has passed at now, oldest deadline first"""
+        cursor = self.get_cursor()
+        cursor.execute('SELECT id FROM tasks WHERE user_id = ? AND complete = 0 AND overdue_at_us < ? ORDER BY overdue_at_us', (user_id, to_micros(now)))
+        return [row[0] for row in cursor.fetchall()]
+
+    def next_transition(self, now: datetime, user_id: int = None) -> datetime:
+        """Earliest instant after now at which an incomplete task (of one user, or of anyone) turns urgent or overdue, or None"""
+        user_filter = 'AND user_id = ?' if user_id is not None else ''
+        now_us = to_micros(now)
+        params = (now_us, user_id, now_us, user_id) if user_id is not None else (now_us, now_us)
+        cursor = self.get_cursor()
+        cursor.execute(f'''
+            SELECT MIN(at) FROM (
+                SELECT MIN(urgent_from_us) AS at FROM tasks WHERE complete = 0 AND urgent_from_us > ? {user_filter}
+                UNION ALL
+                SELECT MIN(overdue_at_us) + 1 AS at FROM tasks WHERE complete = 0 AND overdue_at_us >= ? {user_filter}
+            )
+        ''', params)
+        at = cursor.fetchone()[0]
+        return from_micros(at) if at is not None else None
+
+    def get_transitions(self, user_id: int, since: datetime, until: datetime) -> list[tuple]:
+        """(kind, task id, at) for each of the user's incomplete tasks that turned "urgent" or "overdue" after since, up to until"""
+        since_us, until_us = to_micros(since), to_micros(until)
+        cursor = self.get_cursor()
+        cursor.execute('''
+            SELECT 'urgent', id, urgent_from_us FROM tasks WHERE user_id = ? AND complete = 0 AND urgent_from_us > ? AND urgent_from_us <= ?
+            UNION ALL
+            SELECT 'overdue', id, overdue_at_us + 1 FROM tasks WHERE user_id = ? AND complete = 0 AND overdue_at_us >= ? AND overdue_at_us < ?
+            ORDER BY 3
+        ''', (user_id, since_us, until_us, user_id, since_us, until_us))
+        return [(kind, task_id, from_micros(at)) for kind, task_id, at in cursor.fetchall()]
+
     def get_user_tasks(self, username: str):
         user = self._get_user(username)
         if user:
-            tasks_json = user[4]
-            if tasks_json:
-                tasks_data = json.loads(tasks_json)
-                return [Task(**task_data) for task_data in tasks_data]
-            return []
+            return self.get_tasks_by_user_id(user[0])
         return None
     
     def remove_task_from_user(self, username: str, task_id: str):
-        user = self._get_user(username)
-        if user:
-            if user[4]:
-                tasks_data = json.loads(user[4])
-                tasks = [Task(**task_data) for task_data in tasks_data]
-                original_count = len(tasks)
-                tasks = [task for task in tasks if task.id != task_id]
-                if len(tasks) < original_count:
-                    self._update_user_tasks(username, tasks)
-                    return {"success": True, "response": "Task removed successfully."}
-                else:
-                    return {"success": False, "response": "Task not found."}
-            else:
-                return {"success": False, "response": "No tasks found."}
-        else:
-            return {"success": False, "response": "User not found."}
+        def delete(cursor):
+            cursor.execute('''
+                DELETE FROM tasks WHERE id = ? AND user_id = (SELECT id FROM users WHERE username = ?)
+            ''', (task_id, username))
+            if not cursor.rowcount:
+                return {"success": False, "response": "Task not found."}
+            return {"success": True, "response": "Task removed successfully.", "version": self._bump_version(cursor, username)}
+        try:
+            return self._write(delete)
+        except sqlite3.Error as e:
+            return {"success": False, "response": f"An error occurred: {e}"}
 
-    def mark_task_complete(self, username: str, task_id: str, complete: bool = True):
-        user = self._get_user(username)
-        if user:
-            if user[4]:
-                tasks_data = json.loads(user[4])
-                tasks = [Task(**task_data) for task_data in tasks_data]
-                for task in tasks:
-                    if task.id == task_id:
-                        task.complete = complete
-                        self._update_user_tasks(username, tasks)
-                        return {"success": True, "response": "Task status updated successfully."}
+    def mark_task_complete(self, username: str, task_id: str, complete: bool = True, completed_at: datetime = None):
+        if complete and not completed_at:
+            completed_at = datetime.now()
+        def update(cursor):
+            cursor.execute('''
+                UPDATE tasks SET complete = ?, completed_at = ? WHERE id = ? AND user_id = (SELECT id FROM users WHERE username = ?)
+            ''', (1 if complete else 0, completed_at.isoformat() if complete else None, task_id, username))
+            if not cursor.rowcount:
                 return {"success": False, "response": "Task not found."}
-            else:
-                return {"success": False, "response": "No tasks found."}
-        else:
-            return {"success": False, "response": "User not found."}
+            return {"success": True, "response": "Task status updated successfully.", "version": self._bump_version(cursor, username)}
+        try:
+            return self._write(update)
+        except sqlite3.Error as e:
+            return {"success": False, "response": f"An error occurred: {e}"}
+
+    def add_tasks_to_user(self, username: str, tasks: list[Task]):
+        def insert(cursor):
+            type_table = self._user_type_table(cursor, username)
+            cursor.executemany('''
+                INSERT INTO tasks (id, user_id, title, category, type, difficulty, note, due, deadline, complete, completed_at, urgent_from_us, overdue_at_us)
+                SELECT ?, id, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? FROM users WHERE username = ?
+            ''', [(task.id, *self._task_values(task), *transition_times(task.type, task.deadline_us, type_table), username) for task in tasks])
+            if cursor.rowcount != len(tasks):
+                raise RollbackWrite({"success": False, "response": "User not found."})
+            return {"success": True, "response": f"{len(tasks)} tasks added successfully.", "version": self._bump_version(cursor, username)}
+        try:
+            return self._write(insert)
+        except sqlite3.Error as e:
+            return {"success": False, "response": f"An error occurred: {e}"}
+    
+    def remove_tasks_from_user(self, username: str, task_ids: list[str]):
+        def delete(cursor):
+            cursor.executemany('''
+                DELETE FROM tasks WHERE id = ? AND user_id = (SELECT id FROM users WHERE username = ?)
+            ''', [(task_id, username) for task_id in task_ids])
+            removed = cursor.rowcount
+            result = {"success": True, "response": f"{removed} tasks removed successfully."}
+            if removed:
+                result["version"] = self._bump_version(cursor, username)
+            return result
+        try:
+            return self._write(delete)
+        except sqlite3.Error as e:
+            return {"success": False, "response": f"An error occurred: {e}"}
+    
+    def mark_tasks_complete(self, username: str, updates: list[tuple]):
+        """updates is a list of (task_id, complete, completed_at)"""
+        now = datetime.now()
+        def update(cursor):
+            cursor.executemany('''
+                UPDATE tasks SET complete = ?, completed_at = ? WHERE id = ? AND user_id = (SELECT id FROM users WHERE username = ?)
+            ''', [(1 if complete else 0, (completed_at or now).isoformat() if complete else None, task_id, username) for task_id, complete, completed_at in updates])
+            updated = cursor.rowcount
+            result = {"success": True, "response": f"{updated} tasks updated successfully."}
+            if updated:
+                result["version"] = self._bump_version(cursor, username)
+            return result
+        try:
+            return self._write(update)
+        except sqlite3.Error as e:
+            return {"success": False, "response": f"An error occurred: {e}"}
 
     def update_user(self, username: str, password: str = None, email: str = None):
-        cursor = self.get_cursor()
-        if password:
-            cursor.execute('UPDATE users SET password = ? WHERE username = ?', (password, username))
-        if email:
-            cursor.execute('UPDATE users SET email = ? WHERE username = ?', (email, username))
-        self.connection.commit()
+        def update(cursor):
+            if password:
+                cursor.execute('UPDATE users SET password = ?, version = version + 1 WHERE username = ?', (password, username))
+            if email:
+                cursor.execute('UPDATE users SET email = ?, version = version + 1 WHERE username = ?', (email, username))
+        self._write(update)
 
     def delete_user(self, username: str):
-        cursor = self.get_cursor()
-        cursor.execute('DELETE FROM users WHERE username = ?', (username,))
-        self.connection.commit()
+        def delete(cursor):
+            cursor.execute('DELETE FROM tasks WHERE user_id = (SELECT id FROM users WHERE username = ?)', (username,))
+            cursor.execute('DELETE FROM users WHERE username = ?', (username,))
+        self._write(delete)
 
     def update_user_task_types(self, username: str, task_types: list[str]):
-        cursor = self.get_cursor()
         task_types_json = json.dumps(task_types)
-        cursor.execute('UPDATE users SET task_types = ? WHERE username = ?', (task_types_json, username))
-        self.connection.commit()
-        return {"success": True, "response": "Task types updated successfully."}
+        def update(cursor):
+            cursor.execute('UPDATE users SET task_types = ? WHERE username = ?', (task_types_json, username))
+            return {"success": True, "response": "Task types updated successfully.", "version": self._bump_version(cursor, username)}
+        try:
+            return self._write(update)
+        except sqlite3.Error as e:
+            return {"success": False, "response": f"An error occurred: {e}"}
     
     def update_user_task_difficulties(self, username: str, task_difficulties: list[str]):
-        cursor = self.get_cursor()
         task_difficulties_json = json.dumps(task_difficulties)
-        cursor.execute('UPDATE users SET task_difficulties = ? WHERE username = ?', (task_difficulties_json, username))
-        self.connection.commit()
-        return {"success": True, "response": "Task difficulties updated successfully."}
+        def update(cursor):
+            cursor.execute('UPDATE users SET task_difficulties = ? WHERE username = ?', (task_difficulties_json, username))
+            return {"success": True, "response": "Task difficulties updated successfully.", "version": self._bump_version(cursor, username)}
+        try:
+            return self._write(update)
+        except sqlite3.Error as e:
+            return {"success": False, "response": f"An error occurred: {e}"}
     
     def get_user_task_types(self, username: str):
         user = self._get_user(username)
@@ -255,32 +841,64 @@ class database:
         return ["Easy", "Medium", "Hard"]
     
     def update_user_task_type_settings(self, username: str, task_type_settings: list[TaskTypeSettings]):
-        cursor = self.get_cursor()
-        settings_json = json.dumps([{
-            "name": setting.name,
-            "default_due_days_before_deadline": setting.default_due_days_before_deadline,
-            "prioritize_when_days_left": setting.prioritize_when_days_left,
-            "deadline_format": setting.deadline_format,
-            "priority_rank": setting.priority_rank
-        } for setting in task_type_settings])
-        cursor.execute('UPDATE users SET task_type_settings = ? WHERE username = ?', (settings_json, username))
-        self.connection.commit()
-        return {"success": True, "response": "Task type settings updated successfully."}
+        settings_json = task_type_settings_json(task_type_settings)
+        def update(cursor):
+            cursor.execute('UPDATE users SET task_type_settings = ? WHERE username = ?', (settings_json, username))
+            self._recompute_transitions(cursor, username)
+            return {"success": True, "response": "Task type settings updated successfully.", "version": self._bump_version(cursor, username)}
+        try:
+            return self._write(update)
+        except sqlite3.Error as e:
+            return {"success": False, "response": f"An error occurred: {e}"}
     
     def update_user_difficulty_settings(self, username: str, difficulty_settings: list[DifficultySettings]):
-        cursor = self.get_cursor()
-        settings_json = json.dumps([{
-            "name": setting.name,
-            "priority_rank": setting.priority_rank
-        } for setting in difficulty_settings])
-        cursor.execute('UPDATE users SET difficulty_settings = ? WHERE username = ?', (settings_json, username))
-        self.connection.commit()
-        return {"success": True, "response": "Difficulty settings updated successfully."}
+        settings_json = difficulty_settings_json(difficulty_settings)
+        def update(cursor):
+            cursor.execute('UPDATE users SET difficulty_settings = ? WHERE username = ?', (settings_json, username))
+            return {"success": True, "response": "Difficulty settings updated successfully.", "version": self._bump_version(cursor, username)}
+        try:
+            return self._write(update)
+        except sqlite3.Error as e:
+            return {"success": False, "response": f"An error occurred: {e}"}
     
+    def get_session(self, session_id: str, now: float):
+        """(data, expires_at) of an unexpired session, or None"""
+        cursor = self.get_cursor()
+        cursor.execute('SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?', (session_id, now))
+        return cursor.fetchone()
+
+    def save_session(self, session_id: str, data: str, expires_at: float):
+        def upsert(cursor):
+            cursor.execute('''
+                INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+            ''', (session_id, data, expires_at))
+        self._write(upsert)
+
+    def delete_session(self, session_id: str):
+        # Nothing reads a deleted session back, so there is no need to wait for the commit
+        self._write(lambda cursor: cursor.execute('DELETE FROM sessions WHERE id = ?', (session_id,)), wait=False)
+
+    def delete_expired_sessions(self, now: float, limit: int = 500) -> int:
+        """Delete up to limit expired sessions, oldest first; returns how many were removed (None when not waited for)"""
+        def delete(cursor):
+            cursor.execute('DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE expires_at <= ? ORDER BY expires_at LIMIT ?)', (now, limit))
+            return cursor.rowcount
+        return self._write(delete, wait=False)
+
     def close(self):
         try:
-            if hasattr(self, 'connection') and self.connection:
-                self.connection.close()
+            writer = getattr(self, '_writer', None)
+            if writer is not None:
+                writer.close()
+            connections = getattr(self, '_connections', None)
+            if connections:
+                # Refresh planner statistics so the filter indexes are picked over (user_id, complete)
+                connections[0].execute('PRAGMA optimize')
+                for connection in connections:
+                    connection.close()
+                connections.clear()
+                self._shared = None
                 print("Database connection closed successfully")
         except Exception as e:
             print(f"Error closing database connection: {e}")
@@ -290,17 +908,183 @@ class database:
         self.close()
 
 class TaskManager:
-    def __init__(self, tasks: list[Task] = [], task_type_settings: list[TaskTypeSettings] = [], difficulty_settings: list[DifficultySettings] = []):
+    # Rebuild instead of re-keying one by one once this share of the index is due (e.g. at midnight)
+    REBUILD_FRACTION = 0.125
+
+    def __init__(self, tasks: list[Task] = [], task_type_settings: list[TaskTypeSettings] = [], difficulty_settings: list[DifficultySettings] = [], plan: ScoringPlan = None):
+        """plan (normally a shared one from scoring_plan) takes the place of task_type_settings/difficulty_settings"""
         self.tasks: list[Task] = tasks
-        self.task_type_settings = {setting.name: setting for setting in task_type_settings}
-        self.difficulty_settings = {setting.name: setting for setting in difficulty_settings}
+        self.plan = plan or ScoringPlan(task_type_settings, difficulty_settings)
+
+    # Priority index: incomplete tasks kept sorted as (score, seq, task), where seq follows list
+    # order so ties break exactly like a stable sort. Each task also sits in an expiry heap keyed
+    # by the next instant its score can change, so a read only re-keys tasks whose time passed.
+    # The index is a plain list: an insert or removal is an O(log n) bisect plus an O(n) memmove
+    # of pointers, about 20us at 100k tasks, which is cheaper in practice than a tree of Python
+    # objects. Removed tasks leave stale heap entries behind; the heap is rebuilt from the live
+    # ones once the stale outnumber them.
+
+    @property
+    def tasks(self) -> list[Task]:
+        return self._tasks
+
+    @tasks.setter
+    def tasks(self, tasks: list[Task]):
+        self._tasks = tasks
+        self._by_id = {task.id: task for task in tasks}
+        self._drop_index()
+
+    def get_task(self, task_id: str) -> Task:
+        return self._by_id.get(task_id)
+
+    @property
+    def plan(self) -> ScoringPlan:
+        return self._plan
+
+    @plan.setter
+    def plan(self, plan: ScoringPlan):
+        self._plan = plan
+        self._type_table = plan.type_table
+        self._difficulty_table = plan.difficulty_table
+        self._drop_index()
+
+    @property
+    def task_type_settings(self) -> dict:
+        return self._plan.type_settings
+
+    @property
+    def difficulty_settings(self) -> dict:
+        return self._plan.difficulty_by_name
+
+    def _drop_index(self):
+        self._index = None
+        self._index_entries = {}
+        self._index_expiry = []
+        self._expiring = 0
+        self._index_now = None
+        self._seqs = {}
+        self._next_seq = 0
+
+    @metrics.timed("index_build")
+    def _build_index(self, now: datetime):
+        self._drop_index()
+        for task in self._tasks:
+            self._seqs[task.id] = self._next_seq
+            self._next_seq += 1
+        incomplete_tasks = [task for task in self._tasks if not task.complete]
+        scores = self._plan.scores(incomplete_tasks, now)
+        self._index = []
+        for task, score in zip(incomplete_tasks, scores):
+            entry = (score, self._seqs[task.id], task)
+            self._index.append(entry)
+            self._track(entry, now)
+        self._index.sort(key=lambda entry: entry[:2])
+        self._index_now = now
+
+    def _track(self, entry, now: datetime):
+        task = entry[2]
+        expires = next_score_change(task, self._type_table, now)
+        self._index_entries[task.id] = (entry, expires)
+        if expires is not None:
+            heapq.heappush(self._index_expiry, (expires, entry[1], task.id))
+            self._expiring += 1
+
+    def _untrack(self, task_id: str):
+        tracked = self._index_entries.pop(task_id, None)
+        if tracked and tracked[1] is not None:
+            self._expiring -= 1
+        return tracked
+
+    def _compact_expiry(self):
+        """Rebuild the expiry heap once entries of removed tasks outnumber live ones, so it stays O(live tasks)"""
+        if len(self._index_expiry) > 2 * self._expiring:
+            self._index_expiry = [(expires, entry[1], task_id) for task_id, (entry, expires) in self._index_entries.items() if expires is not None]
+            heapq.heapify(self._index_expiry)
+
+    def _index_insert(self, task: Task, now: datetime):
+        if task.id not in self._seqs:
+            self._seqs[task.id] = self._next_seq
+            self._next_seq += 1
+        entry = (score_one(task, self._type_table, self._difficulty_table, now), self._seqs[task.id], task)
+        bisect.insort(self._index, entry, key=lambda entry: entry[:2])
+        self._track(entry, now)
+
+    def _index_remove(self, task_id: str):
+        tracked = self._untrack(task_id)
+        if tracked:
+            entry = tracked[0]
+            del self._index[bisect.bisect_left(self._index, entry[:2], key=lambda entry: entry[:2])]
+
+    @metrics.timed("index_refresh")
+    def _refresh_index(self, now: datetime):
+        due_ids = []
+        while self._index_expiry and self._index_expiry[0][0] <= now:
+            expires, seq, task_id = heapq.heappop(self._index_expiry)
+            tracked = self._index_entries.get(task_id)
+            if tracked and tracked[1] == expires and tracked[0][1] == seq:
+                due_ids.append(task_id)
+            if len(due_ids) > len(self._index) * self.REBUILD_FRACTION:
+                self._build_index(now)
+                return
+        for task_id in due_ids:
+            task = self._index_entries[task_id][0][2]
+            self._index_remove(task_id)
+            self._index_insert(task, now)
+        self._compact_expiry()
+        self._index_now = now
+
+    def next_change(self) -> datetime:
+        """Earliest instant the current priority order may change, or None if it never will"""
+        if self._index is None:
+            self._build_index(datetime.now())
+        return self._index_expiry[0][0] if self._index_expiry else None
 
     def add_task(self, task: Task):
         self.tasks.append(task)
+        self._by_id[task.id] = task
+        if self._index is not None and not task.complete:
+            self._index_insert(task, self._index_now)
+
+    def mark_complete(self, task: Task, complete: bool = True):
+        task.complete = complete
+        task.completed_at = datetime.now() if complete else None
+        if self._index is not None:
+            self._index_remove(task.id)
+            if not complete:
+                self._index_insert(task, self._index_now)
+            self._compact_expiry()
+
+    def delete_task(self, task_id: str) -> bool:
+        task = self._by_id.pop(task_id, None)
+        if task is None:
+            return False
+        # list.remove is one C-level scan (identity matches first) and a memmove, not a rebuild
+        self._tasks.remove(task)
+        if self._index is not None:
+            self._index_remove(task_id)
+            self._compact_expiry()
+        return True
+
+    def delete_tasks(self, task_ids) -> int:
+        """Delete several tasks in one pass over the task list and the index; returns how many existed"""
+        doomed = {task_id for task_id in task_ids if task_id in self._by_id}
+        if not doomed:
+            return 0
+        self._tasks = [task for task in self._tasks if task.id not in doomed]
+        for task_id in doomed:
+            del self._by_id[task_id]
+        if self._index is not None:
+            self._index = [entry for entry in self._index if entry[2].id not in doomed]
+            for task_id in doomed:
+                self._untrack(task_id)
+            self._compact_expiry()
+        return len(doomed)
 
-    def _calculate_priority_score(self, task: Task) -> int:
+    def _calculate_priority_score(self, task: Task, now: datetime = None) -> int:
+        """Scalar reference for ScoringPlan.scores and score_one, which the priority index uses.
+        Written against the settings objects rather than the compiled tables, so the two can be checked against each other."""
         score = 0
-        now = datetime.now()
+        now = now or datetime.now()
         
         if task.type in self.task_type_settings:
             type_setting = self.task_type_settings[task.type]
@@ -341,42 +1125,59 @@ class TaskManager:
         
         return score
 
-    def get_prioritized_tasks(self) -> list[Task]:
-        incomplete_tasks = [task for task in self.tasks if not task.complete]
-        return sorted(incomplete_tasks, key=self._calculate_priority_score)
+    def get_prioritized_tasks(self, now: datetime = None, task_ids=None) -> list[Task]:
+        """Incomplete tasks in priority order; task_ids limits the result to those tasks"""
+        now = now or datetime.now()
+        if self._index is None or now < self._index_now:
+            self._build_index(now)
+        else:
+            self._refresh_index(now)
+        if task_ids is None:
+            return [entry[2] for entry in self._index]
+        tracked = (self._index_entries.get(task_id) for task_id in task_ids)
+        return [entry[2] for entry in sorted((item[0] for item in tracked if item), key=lambda entry: entry[:2])]
 
-    def get_overdue_tasks(self) -> list[Task]:
-        now = datetime.now()
+    def get_overdue_tasks(self, now: datetime = None) -> list[Task]:
+        now = now or datetime.now()
         return [task for task in self.tasks if not task.complete and task.deadline and now > task.deadline]
     
-    def get_urgent_tasks(self) -> list[Task]:
-        urgent_tasks = []
-        now = datetime.now()
-        
-        for task in self.tasks:
-            if task.complete or not task.deadline:
-                continue
-                
-            if task.type in self.task_type_settings:
-                setting = self.task_type_settings[task.type]
-                
-                if setting.deadline_format == "datetime":
-                    hours_left = (task.deadline - now).total_seconds() / 3600
-                    threshold_hours = setting.prioritize_when_days_left * 24
-                    if hours_left <= threshold_hours:
-                        urgent_tasks.append(task)
-                else:
-                    days_left = (task.deadline.date() - now.date()).days
-                    if days_left <= setting.prioritize_when_days_left:
-                        urgent_tasks.append(task)
-        
-        return urgent_tasks
+    def _is_urgent(self, task: Task, now: datetime) -> bool:
+        if task.complete:
+            return False
+        urgent_from, _ = transition_times(task.type, task.deadline_us, self._type_table)
+        return urgent_from is not None and to_micros(now) >= urgent_from
+    
+    def get_urgent_tasks(self, now: datetime = None) -> list[Task]:
+        now = now or datetime.now()
+        return [task for task in self.tasks if self._is_urgent(task, now)]
+
+    @metrics.timed("partition")
+    def partition(self, now: datetime = None, task_ids=None) -> dict[str, list[Task]]:
+        """Split incomplete tasks (or just task_ids) into overdue, urgent (not overdue) and the rest, each in priority order, all against one timestamp"""
+        now = now or datetime.now()
+        buckets = {"overdue": [], "urgent": [], "prioritized": []}
+        for task in self.get_prioritized_tasks(now, task_ids):
+            if task.deadline and now > task.deadline:
+                buckets["overdue"].append(task)
+            elif self._is_urgent(task, now):
+                buckets["urgent"].append(task)
+            else:
+                buckets["prioritized"].append(task)
+        return buckets
 
     def get_completed_tasks(self) -> list[Task]:
         """Return tasks that are marked as complete"""
         return [task for task in self.tasks if task.complete]
 
 class User:
+    """A user's settings and tasks, loaded once.
+
+    UserCache hands the same instance to every concurrent request for that user,
+    so every access to taskManager (writes, and reads, which may rebuild the
+    priority index) happens under self._lock, and methods return lists the
+    caller owns rather than the live ones. Writes change memory first, so one
+    that fails or raises drops the user from the cache.
+    """
     def __init__(self, user_id: int, db: database, tasks: list[Task] = []):
         self.user_id = user_id
         self.username = None
@@ -384,56 +1185,68 @@ class User:
         self.tasks = tasks
         self.task_types = []
         self.task_difficulties = []
-        self.task_type_settings = []
-        self.difficulty_settings = []
+        self.plan = None
+        self.version = None
+        self.cache = None
+        self._lock = threading.RLock()
         if not self._load_data()["success"]:
             raise ValueError("User not found or no tasks available.")
-        self.taskManager = TaskManager(self.tasks, self.task_type_settings, self.difficulty_settings)
+        self.taskManager = TaskManager(self.tasks, plan=self.plan)
 
+    @metrics.timed("load_data")
     def _load_data(self):
+        # Read first: a write landing while the rest loads makes the copy look older than it is, never newer
+        self.version = self.db.get_user_version(self.user_id)
         user_data = self.db.get_user_by_id(self.user_id)
         if user_data:
             self.username = user_data['username']
-            if user_data['tasks']:
-                tasks_data = json.loads(user_data['tasks'])
-                self.tasks = [Task(**task_data) for task_data in tasks_data]
-            else:
-                self.tasks = []
+            self.tasks = self.db.get_tasks_by_user_id(self.user_id)
             
-            self.task_types = json.loads(user_data['task_types']) if user_data['task_types'] else ["Short term", "Long term"]
-            self.task_difficulties = json.loads(user_data['task_difficulties']) if user_data['task_difficulties'] else ["Easy", "Medium", "Hard"]
+            self.task_types = serializers.loads(user_data['task_types']) if user_data['task_types'] else ["Short term", "Long term"]
+            self.task_difficulties = serializers.loads(user_data['task_difficulties']) if user_data['task_difficulties'] else ["Easy", "Medium", "Hard"]
             
-            if user_data['task_type_settings']:
-                settings_data = json.loads(user_data['task_type_settings'])
-                self.task_type_settings = [TaskTypeSettings(**setting) for setting in settings_data]
-            else:
-                self.task_type_settings = [
-                    TaskTypeSettings("Short term", 1, 1, "date", 0),
-                    TaskTypeSettings("Long term", 7, 14, "date", 1)
-                ]
-            
-            if user_data['difficulty_settings']:
-                settings_data = json.loads(user_data['difficulty_settings'])
-                self.difficulty_settings = [DifficultySettings(**setting) for setting in settings_data]
-            else:
-                self.difficulty_settings = [
-                    DifficultySettings("Easy", 2),
-                    DifficultySettings("Medium", 1),
-                    DifficultySettings("Hard", 0)
-                ]
+            self.plan = scoring_plan(user_data['task_type_settings'], user_data['difficulty_settings'])
         else:
             return {"success": False, "response": "User not found."}
         return {"success": True, "response": "User data loaded successfully."}
     
-    def _add_task(self, task: Task):
-        self.tasks.append(task)
-        self.taskManager.tasks = self.tasks
-        result = self.db.add_task_to_user(self.username, task)
+    def _written(self, result):
+        """Tell the owning UserCache (if any) whether this write reached the database, and at which version"""
+        if self.cache is not None:
+            self.cache.written(self, result)
         return result
     
+    @contextmanager
+    def _writing(self):
+        """Hold the lock for a write; if it raises, the in-memory change may not have reached the database, so drop the cached copy"""
+        with self._lock:
+            try:
+                yield
+            except BaseException:
+                if self.cache is not None:
+                    self.cache.invalidate(self.user_id)
+                raise
+    
+    def _add_task(self, task: Task):
+        with self._writing():
+            self.taskManager.add_task(task)
+            result = self.db.add_task_to_user(self.username, task)
+            return self._written(result)
+    
     def add_task(self, title: str, category: str, task_type: str, deadline_input, difficulty: str = None, note: str = None):
+        return self._add_task(self.build_task(title, category, task_type, deadline_input, difficulty, note))
+    
+    def add_tasks(self, tasks: list[Task]):
+        """Add several built tasks with a single database transaction"""
+        with self._writing():
+            for task in tasks:
+                self.taskManager.add_task(task)
+            result = self.db.add_tasks_to_user(self.username, tasks)
+            return self._written(result)
+    
+    def build_task(self, title: str, category: str, task_type: str, deadline_input, difficulty: str = None, note: str = None) -> Task:
         type_setting = self.get_task_type_setting(task_type)
-        format_type = type_setting.deadline_format if type_setting else "date"
+        format_type = self.plan.deadline_format(task_type)
         
         task = Task(title=title, category=category, type=task_type, due=None, deadline=None, difficulty=difficulty, note=note)
         
@@ -449,20 +1262,32 @@ class User:
                     task.due = task.deadline
                 else:
                     due_date = task.deadline.date() - timedelta(days=days_before)
-                    task.due = datetime.combine(due_date, datetime.time(23, 59, 59))
+                    task.due = datetime.combine(due_date, datetime.min.time().replace(hour=23, minute=59, second=59))
         else:
             if task_type == "Short term":
                 task.due = task.deadline
             else:
                 task.due = task.deadline - timedelta(days=1)
         
-        return self._add_task(task)
+        return task
     
     def get_tasks(self) -> list[Task]:
-        return self.tasks
+        with self._lock:
+            return list(self.taskManager.tasks)
     
     def get_prioritized_tasks(self) -> list[Task]:
-        return self.taskManager.get_prioritized_tasks()
+        with self._lock:
+            return self.taskManager.get_prioritized_tasks()
+    
+    def partition_tasks(self, now: datetime = None, task_filter: TaskFilter = None) -> dict[str, list[Task]]:
+        """Overdue/urgent/prioritized buckets; with a filter the matching ids come from SQL and keep their priority order"""
+        task_ids = self.db.get_task_ids(self.user_id, task_filter, complete=False) if task_filter else None
+        with self._lock:
+            return self.taskManager.partition(now, task_ids)
+    
+    def next_priority_change(self) -> datetime:
+        with self._lock:
+            return self.taskManager.next_change()
     
     def get_task_types(self) -> list[str]:
         return self.task_types
@@ -471,57 +1296,60 @@ class User:
         return self.task_difficulties
     
     def update_task_types(self, task_types: list[str]):
-        self.task_types = task_types
-        return self.db.update_user_task_types(self.username, task_types)
+        with self._writing():
+            self.task_types = task_types
+            return self._written(self.db.update_user_task_types(self.username, task_types))
     
     def update_task_difficulties(self, task_difficulties: list[str]):
-        self.task_difficulties = task_difficulties
-        return self.db.update_user_task_difficulties(self.username, task_difficulties)
+        with self._writing():
+            self.task_difficulties = task_difficulties
+            return self._written(self.db.update_user_task_difficulties(self.username, task_difficulties))
+    
+    @property
+    def task_type_settings(self) -> tuple[TaskTypeSettings]:
+        return self.plan.task_type_settings
+    
+    @property
+    def difficulty_settings(self) -> tuple[DifficultySettings]:
+        return self.plan.difficulty_settings
     
-    def get_task_type_settings(self) -> list[TaskTypeSettings]:
-        return self.task_type_settings
+    def get_task_type_settings(self) -> tuple[TaskTypeSettings]:
+        return self.plan.task_type_settings
     
     def get_task_type_setting(self, task_type: str) -> TaskTypeSettings:
-        for setting in self.task_type_settings:
-            if setting.name == task_type:
-                return setting
-        return None
+        return self.plan.type_settings.get(task_type)
     
-    def get_difficulty_settings(self) -> list[DifficultySettings]:
-        return self.difficulty_settings
+    def get_difficulty_settings(self) -> tuple[DifficultySettings]:
+        return self.plan.difficulty_settings
     
     def get_difficulty_setting(self, difficulty: str) -> DifficultySettings:
-        for setting in self.difficulty_settings:
-            if setting.name == difficulty:
-                return setting
-        return None
+        return self.plan.difficulty_by_name.get(difficulty)
+    
+    def _set_plan(self, plan: ScoringPlan):
+        self.plan = plan
+        self.taskManager.plan = plan
     
     def update_task_type_settings(self, task_type_settings: list[TaskTypeSettings]):
-        self.task_type_settings = task_type_settings
-        self.taskManager.task_type_settings = {setting.name: setting for setting in task_type_settings}
-        return self.db.update_user_task_type_settings(self.username, task_type_settings)
+        """Replace the task type settings; the plan is rebuilt (or found in the cache) only here and in update_difficulty_settings"""
+        with self._writing():
+            self._set_plan(scoring_plan(task_type_settings_json(task_type_settings), difficulty_settings_json(self.plan.difficulty_settings)))
+            return self._written(self.db.update_user_task_type_settings(self.username, self.plan.task_type_settings))
     
     def update_difficulty_settings(self, difficulty_settings: list[DifficultySettings]):
-        self.difficulty_settings = difficulty_settings
-        self.taskManager.difficulty_settings = {setting.name: setting for setting in difficulty_settings}
-        return self.db.update_user_difficulty_settings(self.username, difficulty_settings)
+        with self._writing():
+            self._set_plan(scoring_plan(task_type_settings_json(self.plan.task_type_settings), difficulty_settings_json(difficulty_settings)))
+            return self._written(self.db.update_user_difficulty_settings(self.username, self.plan.difficulty_settings))
     
     def calculate_default_due_date(self, task_type: str, deadline: datetime) -> datetime:
-        for setting in self.task_type_settings:
-            if setting.name == task_type:
-                return deadline - timedelta(days=setting.default_due_days_before_deadline)
-        return deadline - timedelta(days=1)
+        type_setting = self.plan.type_settings.get(task_type)
+        return deadline - timedelta(days=type_setting.default_due_days_before_deadline if type_setting else 1)
 
     def add_task_with_deadline(self, title: str, category: str, task_type: str, deadline_input, difficulty: str = None, note: str = None):
-        type_setting = None
-        for setting in self.task_type_settings:
-            if setting.name == task_type:
-                type_setting = setting
-                break
+        type_setting = self.plan.type_settings.get(task_type)
         
         task = Task(title=title, category=category, type=task_type, due=None, deadline=None, difficulty=difficulty, note=note)
         
-        format_type = type_setting.deadline_format if type_setting else "date"
+        format_type = self.plan.deadline_format(task_type)
         task.set_deadline_with_time_setting(deadline_input, format_type)
         
         if type_setting:
@@ -537,46 +1365,62 @@ class User:
         
         return self.add_task(task)
     
-    def get_overdue_tasks(self) -> list[Task]:
-        return self.taskManager.get_overdue_tasks()
+    def get_overdue_tasks(self, now: datetime = None) -> list[Task]:
+        """Range query on the stored transition times rather than a scan of every task"""
+        return [task for task in map(self.get_task_by_id, self.db.get_overdue_task_ids(self.user_id, now or datetime.now())) if task]
     
-    def get_urgent_tasks(self) -> list[Task]:
-        return self.taskManager.get_urgent_tasks()
+    def get_urgent_tasks(self, now: datetime = None) -> list[Task]:
+        return [task for task in map(self.get_task_by_id, self.db.get_urgent_task_ids(self.user_id, now or datetime.now())) if task]
+
+    def next_transition(self, now: datetime = None) -> datetime:
+        """When the next of this user's tasks turns urgent or overdue"""
+        return self.db.next_transition(now or datetime.now(), self.user_id)
     
     def get_completed_tasks(self) -> list[Task]:
-        return self.taskManager.get_completed_tasks()
+        with self._lock:
+            return self.taskManager.get_completed_tasks()
     
     def get_deadline_format_for_type(self, task_type: str) -> str:
-        for setting in self.task_type_settings:
-            if setting.name == task_type:
-                return setting.deadline_format
-        return "date"
+        return self.plan.deadline_format(task_type)
     
     def delete_task(self, task_id: str):
-        original_count = len(self.tasks)
-        self.tasks = [task for task in self.tasks if task.id != task_id]
-        
-        if len(self.tasks) < original_count:
-            self.taskManager.tasks = self.tasks
-            result = self.db.remove_task_from_user(self.username, task_id)
-            return result
-        else:
-            return {"success": False, "response": "Task not found."}
+        with self._writing():
+            if self.taskManager.delete_task(task_id):
+                self.tasks = self.taskManager.tasks
+                result = self.db.remove_task_from_user(self.username, task_id)
+                return self._written(result)
+            else:
+                return {"success": False, "response": "Task not found."}
+    
+    def delete_tasks(self, task_ids: list[str]):
+        """Delete several existing tasks with a single database transaction"""
+        with self._writing():
+            self.taskManager.delete_tasks(task_ids)
+            self.tasks = self.taskManager.tasks
+            result = self.db.remove_tasks_from_user(self.username, task_ids)
+            return self._written(result)
     
     def get_task_by_id(self, task_id: str) -> Task:
-        for task in self.tasks:
-            if task.id == task_id:
-                return task
-        return None
+        with self._lock:
+            return self.taskManager.get_task(task_id)
     
     def mark_complete(self, task_id: str, complete: bool = True):
-        for task in self.tasks:
-            if task.id == task_id:
-                task.complete = complete
-                self.taskManager.tasks = self.tasks
-                result = self.db.mark_task_complete(self.username, task_id, complete)
-                return result
-        return {"success": False, "response": "Task not found."}
+        with self._writing():
+            task = self.get_task_by_id(task_id)
+            if task is None:
+                return {"success": False, "response": "Task not found."}
+            self.taskManager.mark_complete(task, complete)
+            result = self.db.mark_task_complete(self.username, task_id, complete, task.completed_at)
+            return self._written(result)
+    
+    def mark_complete_many(self, task_ids: list[str], complete: bool = True):
+        """Set the completion state of several existing tasks with a single database transaction"""
+        with self._writing():
+            tasks = [task for task in map(self.get_task_by_id, task_ids) if task]
+            for task in tasks:
+                self.taskManager.mark_complete(task, complete)
+            result = self.db.mark_tasks_complete(self.username, [(task.id, complete, task.completed_at) for task in tasks])
+            return self._written(result)
 
 def test():
     db = database("tasks.db")
@@ -0,0 +1,281 @@
+"""ASGI entry point for the task API: `uvicorn asgi:application` (or any ASGI server).
+
+Every route and JSON contract is the Flask app in api.py. Ordinary requests run
+it on a bounded thread pool (ASGI_THREADS), so CPU-bound work (scoring, JSON)
+and SQLite stay off the event loop. A thousand idle clients cost a thousand
+coroutines, not a thousand threads. Each request still holds a pool thread for
+as long as its route runs, including any SQLite wait.
+
+Two kinds of request are partly served here instead. /login and /register
+await their bcrypt work on the event loop before the Flask route runs, so a
+slow hash holds no pool thread; the route picks up the settled result from the
+environ. Only a request whose body isn't the JSON those routes expect falls
+back to hashing on the pool thread. The Flask route for /tasks/events only
+authenticates and subscribes, and the stream itself is served here on the
+event loop. Database lookups made here go through AsyncDatabase, which awaits
+calls on a small dedicated pool.
+"""
+import asyncio
+import functools
+import io
+import json
+import os
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+import api
+from events import HEARTBEAT, RESYNC
+from passwords import HasherBusy
+
+# Request bodies are read into memory before the Flask app runs
+MAX_BODY_SIZE = int(os.environ.get('ASGI_MAX_BODY', 16 * 1024 * 1024))
+
+
+class AsyncDatabase:
+    """Awaitable database methods, e.g. `await adb.next_transition(now, user_id)`.
+
+    Each call runs on a dedicated pool, and the pooled connection goes back
+    as soon as the call returns, so awaiting coroutines hold no connection.
+    """
+    def __init__(self, db, max_workers: int = 4):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db-async')
+
+    def _call(self, fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.db.release()
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self._call, fn, *args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        return call
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def build_environ(scope: dict, body: bytes) -> dict:
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    path = scope.get('raw_path') or scope['path'].encode('utf-8')
+    root_path = scope.get('root_path', '').encode('utf-8')
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.decode('latin-1'),
+        'PATH_INFO': path.split(b'?', 1)[0].decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'queup.asgi': True
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = 'HTTP_' + name
+        if key in environ:
+            value = environ[key] + ('; ' if name == 'COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+
+class ASGIApplication:
+    def __init__(self, wsgi_app, threads: int = 16, db_threads: int = 4):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+        self.adb = AsyncDatabase(api.db, db_threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.handle_lifespan(receive, send)
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                api.events.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive) -> bytes:
+        """The whole request body, or None once it exceeds MAX_BODY_SIZE"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ConnectionError("Client disconnected")
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY_SIZE:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def handle_http(self, scope, receive, send):
+        try:
+            body = await self.read_body(receive)
+        except ConnectionError:
+            return
+        if body is None:
+            await send({'type': 'http.response.start', 'status': 413, 'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b'Request body too large'})
+            return
+
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, body)
+        if scope['method'] == 'POST' and environ['PATH_INFO'] in ('/login', '/register'):
+            await self.settle_passwords(environ, body)
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        await loop.run_in_executor(self.executor, self.run_wsgi, environ, send_from_thread)
+
+        subscription = environ.get('queup.event_stream')
+        try:
+            if subscription is not None:
+                await self.stream_events(subscription, receive, send)
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        except OSError:
+            # The client went away mid-send
+            pass
+
+    async def settle(self, submit, *args) -> Future:
+        """Start a hasher call and await it (up to the hasher's timeout) without holding a thread;
+        the route's future.result(0) then returns it, or raises HasherBusy or TimeoutError as hasher.hash would"""
+        try:
+            future = submit(*args)
+        except HasherBusy as e:
+            future = Future()
+            future.set_exception(e)
+            return future
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), api.hasher.timeout)
+        except Exception:
+            pass
+        return future
+
+    async def settle_passwords(self, environ: dict, body: bytes):
+        """Do the bcrypt work /login or /register would do, keyed so the route only uses it for the same password (and stored hash)"""
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return
+        if not isinstance(data, dict) or not isinstance(data.get('password'), str) or not data.get('username'):
+            return
+        password = data['password']
+        hasher = api.hasher
+        if environ['PATH_INFO'] == '/register':
+            if data.get('email') and len(password) >= 8:
+                environ['queup.password_hashes'] = {password: await self.settle(hasher.submit_hash, password)}
+            return
+        user = await self.adb.get_user(data['username']) if password else None
+        if not user:
+            return
+        checked = await self.settle(hasher.submit_verify, password, user['password'])
+        environ['queup.password_checks'] = {(password, user['password']): checked}
+        if checked.done() and not checked.exception() and checked.result() and hasher.needs_rehash(user['password']):
+            environ['queup.password_hashes'] = {password: await self.settle(hasher.submit_hash, password)}
+
+    def run_wsgi(self, environ: dict, send):
+        """Run the Flask app on a pool thread, forwarding the response to the event loop chunk by chunk"""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        def start():
+            if not response.get('started'):
+                response['started'] = True
+                send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+
+        app_iter = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in app_iter:
+                if chunk:
+                    start()
+                    send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                close()
+        start()
+
+    async def stream_events(self, subscription, receive, send):
+        """Async counterpart of api.stream_events"""
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            subscription.close()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        user_id = subscription.user_id
+        checked = datetime.now()
+        try:
+            await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+            next_at = await self.adb.next_transition(checked, user_id)
+            while True:
+                timeout = api.SSE_HEARTBEAT
+                if next_at is not None:
+                    timeout = min(timeout, max(0.0, (next_at - datetime.now()).total_seconds()))
+                frames = await subscription.get_async(timeout)
+                if frames is None:
+                    return
+                now = datetime.now()
+                if frames or (next_at is not None and now >= next_at):
+                    frames += api.encode_transitions(await self.adb.get_transitions(user_id, checked, now))
+                    checked = now
+                    next_at = await self.adb.next_transition(now, user_id)
+                if subscription.catch_up(await self.adb.get_user_version(user_id)):
+                    frames.append(RESYNC)
+                    next_at = await self.adb.next_transition(now, user_id)
+                await send({'type': 'http.response.body', 'body': b''.join(frames) if frames else HEARTBEAT, 'more_body': True})
+        finally:
+            watcher.cancel()
+            api.events.unsubscribe(subscription)
+
+
+application = ASGIApplication(api.app, threads=int(os.environ.get('ASGI_THREADS', 16)), db_threads=int(os.environ.get('ASGI_DB_THREADS', 4)))
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("asgi.py needs an ASGI server to run, e.g. `pip install uvicorn`")
+    uvicorn.run(application, host='0.0.0.0', port=5001)
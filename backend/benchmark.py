@@ -0,0 +1,235 @@
+"""Reproducible benchmarks for TaskManager, database and the API routes.
+
+Generates synthetic users with a fixed seed (mixed "date"/"datetime" deadline
+formats, overdue/urgent/far-off deadlines, some completed tasks) in a scratch
+directory, never touching tasks.db, and writes machine-readable results:
+
+    python benchmark.py --sizes 10 1000 10000 --output results.json
+    python benchmark.py --sizes 100000 --repeat 3 --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BACKEND_DIR)
+
+TASK_TYPES = [
+    {"name": "Short term", "default_due_days_before_deadline": 1, "prioritize_when_days_left": 1, "deadline_format": "date", "priority_rank": 0},
+    {"name": "Long term", "default_due_days_before_deadline": 7, "prioritize_when_days_left": 14, "deadline_format": "datetime", "priority_rank": 1},
+    {"name": "Exam", "default_due_days_before_deadline": 3, "prioritize_when_days_left": 5, "deadline_format": "datetime", "priority_rank": 2}
+]
+DIFFICULTIES = ["Easy", "Medium", "Hard"]
+PASSWORD = "benchmark-password"
+
+
+def timed(fn, repeat: int, setup=None) -> list[float]:
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        fn(state) if setup else fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def synthetic_tasks(Task, count: int, rng: random.Random, now: datetime) -> list:
+    tasks = []
+    for i in range(count):
+        task_type = rng.choice(TASK_TYPES)
+        deadline = now + timedelta(minutes=rng.randint(-14 * 24 * 60, 60 * 24 * 60))
+        if task_type["deadline_format"] == "date":
+            deadline = deadline.replace(hour=23, minute=59, second=59, microsecond=0)
+        due = deadline - timedelta(days=task_type["default_due_days_before_deadline"])
+        complete = rng.random() < 0.2
+        tasks.append(Task(
+            title=f"Task {i}", category=rng.choice(["Homework", "Project", "Chores"]), type=task_type["name"],
+            due=due, deadline=deadline, difficulty=rng.choice(DIFFICULTIES), note="https://example.com/assignment" if i % 3 else None,
+            complete=complete, id=str(uuid.UUID(int=rng.getrandbits(128))), completed_at=deadline - timedelta(hours=1) if complete else None
+        ))
+    return tasks
+
+
+class Suite:
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results = []
+
+    def record(self, group: str, name: str, size: int, times: list[float]):
+        result = {
+            "group": group,
+            "name": name,
+            "size": size,
+            "repeat": len(times),
+            "min": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.fmean(times)
+        }
+        self.results.append(result)
+        print(f"{group:10} {name:42} n={size:<7} min {result['min'] * 1000:9.3f} ms  median {result['median'] * 1000:9.3f} ms", flush=True)
+
+    def run(self, group: str, name: str, size: int, fn, setup=None, repeat: int = None):
+        self.record(group, name, size, timed(fn, repeat or self.repeat, setup))
+
+
+def seed_user(api, username: str, tasks: list) -> dict:
+    db = api.db
+    db.add_user(username, api.hasher.hash(PASSWORD), f"{username}@example.com")
+    user = db.get_user(username)
+    db.update_user_task_type_settings(username, [api.TaskTypeSettings(**setting) for setting in TASK_TYPES])
+    for start in range(0, len(tasks), 5000):
+        db.add_tasks_to_user(username, tasks[start:start + 5000])
+    return user
+
+
+def bench_size(api, suite: Suite, size: int, seed: int):
+    from app import Task, TaskManager, TaskTypeSettings, DifficultySettings, User
+
+    rng = random.Random(seed + size)
+    now = datetime.now()
+    tasks = synthetic_tasks(Task, size, rng, now)
+    type_settings = [TaskTypeSettings(**setting) for setting in TASK_TYPES]
+    difficulty_settings = [DifficultySettings(name, rank) for rank, name in enumerate(reversed(DIFFICULTIES))]
+
+    # TaskManager: cold means a fresh manager (full scoring), warm reuses its priority index
+    suite.run("manager", "get_prioritized_tasks (cold)", size, lambda manager: manager.get_prioritized_tasks(),
+              setup=lambda: TaskManager(list(tasks), type_settings, difficulty_settings))
+    warm = TaskManager(list(tasks), type_settings, difficulty_settings)
+    warm.get_prioritized_tasks()
+    suite.run("manager", "get_prioritized_tasks (warm)", size, warm.get_prioritized_tasks)
+    suite.run("manager", "get_urgent_tasks", size, warm.get_urgent_tasks)
+    suite.run("manager", "get_overdue_tasks", size, warm.get_overdue_tasks)
+    suite.run("manager", "partition (warm)", size, warm.partition)
+
+    username = f"bench_{size}_{seed}"
+    user_row = seed_user(api, username, tasks)
+    db = api.db
+    user = User(user_row["id"], db)
+    suite.run("user", "User._load_data", size, user._load_data)
+    suite.run("user", "User()", size, lambda: User(user_row["id"], db))
+
+    # database write paths, each against the populated user
+    extra = synthetic_tasks(Task, suite.repeat * 3, rng, now)
+    pending = iter(extra)
+    added = []
+    def add_one():
+        task = next(pending)
+        db.add_task_to_user(username, task)
+        added.append(task.id)
+    suite.run("database", "add_task_to_user", size, add_one)
+    suite.run("database", "mark_task_complete", size, lambda: db.mark_task_complete(username, added[0], True))
+    suite.run("database", "remove_task_from_user", size, lambda: db.remove_task_from_user(username, added.pop()))
+    batch = synthetic_tasks(Task, 100, rng, now)
+    suite.run("database", "add_tasks_to_user (100)", size, lambda fresh: db.add_tasks_to_user(username, fresh),
+              setup=lambda: [Task(t.title, t.category, t.type, t.due, t.deadline, t.difficulty, t.note) for t in batch])
+    suite.run("database", "update_user_task_type_settings", size, lambda: db.update_user_task_type_settings(username, type_settings))
+    suite.run("database", "update_user_difficulty_settings", size, lambda: db.update_user_difficulty_settings(username, difficulty_settings))
+    suite.run("database", "update_user_task_types", size, lambda: db.update_user_task_types(username, [s["name"] for s in TASK_TYPES]))
+    suite.run("database", "update_user_task_difficulties", size, lambda: db.update_user_task_difficulties(username, DIFFICULTIES))
+
+    # Routes through the Flask test client, logged in as the synthetic user
+    client = api.app.test_client()
+    client.post('/login', json={'username': username, 'password': PASSWORD})
+    def ok(response, expected=(200, 201, 304)):
+        assert response.status_code in expected, (response.request.path, response.status_code, response.get_data(as_text=True))
+        response.get_data()
+    def get(path):
+        ok(client.get(path), (200,))
+    api.users.clear()
+    suite.run("route", "GET /tasks (uncached user)", size, lambda _: get('/tasks'), setup=api.users.clear)
+    suite.run("route", "GET /tasks", size, lambda: get('/tasks'))
+    etag = client.get('/tasks').headers.get('ETag')
+    suite.run("route", "GET /tasks (If-None-Match)", size, lambda: ok(client.get('/tasks', headers={'If-None-Match': etag} if etag else {})))
+    suite.run("route", "GET /tasks/completed", size, lambda: get('/tasks/completed'))
+    suite.run("route", "GET /tasks/completed?limit=50", size, lambda: get('/tasks/completed?limit=50'))
+    suite.run("route", "GET /settings", size, lambda: get('/settings'))
+    suite.run("route", "GET /me", size, lambda: get('/me'))
+    new_task = {'title': 'Bench', 'category': 'Homework', 'type': 'Long term', 'difficulty': 'Hard', 'deadline': (now + timedelta(days=3)).isoformat()}
+    suite.run("route", "POST /tasks", size, lambda: ok(client.post('/tasks', json=new_task)))
+    task_ids = [task.id for task in tasks if not task.complete][:suite.repeat]
+    toggles = iter(task_ids * 2)
+    suite.run("route", "PUT /tasks/complete/<id>", size, lambda: ok(client.put(f'/tasks/complete/{next(toggles)}')))
+    suite.run("route", "POST /tasks/batch (100)", size, lambda: ok(client.post('/tasks/batch', json={'tasks': [new_task] * 100})))
+    deletions = iter(task_ids)
+    suite.run("route", "DELETE /tasks/<id>", size, lambda: ok(client.delete(f'/tasks/{next(deletions)}')), repeat=len(task_ids))
+    settings_body = {'task_types': TASK_TYPES, 'difficulties': [{'name': name, 'priority_rank': rank} for rank, name in enumerate(reversed(DIFFICULTIES))]}
+    suite.run("route", "PUT /settings", size, lambda: ok(client.put('/settings', json=settings_body)))
+    suite.run("route", "PUT /settings/priority-order", size, lambda: ok(client.put('/settings/priority-order', json={'task_types_order': [s["name"] for s in TASK_TYPES]})))
+    suite.run("route", "POST /login", size, lambda: ok(client.post('/login', json={'username': username, 'password': PASSWORD})))
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    optional = {}
+    for module in ('numpy', 'orjson'):
+        try:
+            optional[module] = __import__(module).__version__
+        except ImportError:
+            optional[module] = None
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "optional": optional
+    }
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {(r["group"], r["name"], r["size"]): r for r in json.load(f)["results"]}
+    print()
+    print(f"{'benchmark':54} {'size':>7} {'baseline':>11} {'current':>11} {'ratio':>7}")
+    for result in results:
+        before = baseline.get((result["group"], result["name"], result["size"]))
+        if before:
+            ratio = result["median"] / before["median"] if before["median"] else float('inf')
+            print(f"{result['group'] + ' ' + result['name']:54} {result['size']:>7} {before['median'] * 1000:9.3f}ms {result['median'] * 1000:9.3f}ms {ratio:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000], help="tasks per synthetic user (100000 works but is slow)")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="print median ratios against a previous --output file")
+    parser.add_argument('--shards', type=int, default=1, help="spread users over this many SQLite files (DB_SHARDS)")
+    args = parser.parse_args()
+
+    # api opens tasks.db relative to the working directory, so import it from a scratch directory
+    scratch = tempfile.mkdtemp(prefix='queup-bench-')
+    os.chdir(scratch)
+    os.environ.setdefault('BCRYPT_ROUNDS', '4')
+    if args.shards > 1:
+        os.environ['DB_SHARDS'] = str(args.shards)
+    import api
+
+    suite = Suite(args.repeat)
+    for size in args.sizes:
+        bench_size(api, suite, size, args.seed)
+
+    report = {"environment": environment(), "config": vars(args), "results": suite.results}
+    if args.output:
+        with open(os.path.join(BACKEND_DIR, args.output) if not os.path.isabs(args.output) else args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(suite.results, args.compare if os.path.isabs(args.compare) else os.path.join(BACKEND_DIR, args.compare))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""In-process fan-out of per-user task events for the /tasks/events stream.
+
+Subscriptions are registered by user id, so publishing for a user with no open
+stream is a single dict lookup. Each message is encoded once, as a complete
+Server-Sent Events frame, and the same bytes are queued for every subscriber.
+A subscriber's queue is bounded: a client that falls max_events behind loses
+its backlog and is sent one "resync" event instead, telling it to refetch.
+Threaded servers block in Subscription.get(); asyncio streams await get_async().
+
+Events only reach streams in the process that made the change. Each
+subscription therefore tracks the user version its events brought it up to.
+Streams compare it with users.version whenever they wake, and send resync
+when another process has written in the meantime (see catch_up).
+"""
+import asyncio
+import threading
+from collections import deque
+import serializers
+
+RESYNC = b'event: resync\ndata: {}\n\n'
+HEARTBEAT = b': keepalive\n\n'
+
+
+def encode_event(event: str, data) -> bytes:
+    return b'event: ' + event.encode('utf-8') + b'\ndata: ' + serializers.dumps(data) + b'\n\n'
+
+
+class Subscription:
+    __slots__ = ('user_id', 'max_events', 'version', 'closed', '_events', '_overflowed', '_condition', '_wakeup')
+
+    def __init__(self, user_id: int, max_events: int, version: int = None):
+        self.user_id = user_id
+        self.max_events = max_events
+        self.version = version
+        self.closed = False
+        self._events = deque()
+        self._overflowed = False
+        self._condition = threading.Condition(threading.Lock())
+        self._wakeup = None
+
+    def put(self, frame: bytes, version: int = None):
+        with self._condition:
+            self._advance(version)
+            if self._overflowed:
+                return
+            if len(self._events) >= self.max_events:
+                self._events.clear()
+                self._overflowed = True
+            else:
+                self._events.append(frame)
+            self._notify()
+
+    def _advance(self, version: int):
+        if version is not None and (self.version is None or version > self.version):
+            self.version = version
+
+    def catch_up(self, version: int) -> bool:
+        """Note the user's current version; True if it is past everything this stream has been sent,
+        i.e. the user changed somewhere this hub didn't see and the client should resync"""
+        with self._condition:
+            behind = version is not None and self.version is not None and version > self.version
+            self._advance(version)
+            return behind
+
+    def _notify(self):
+        self._condition.notify()
+        if self._wakeup is not None:
+            self._wakeup()
+
+    def _ready(self) -> bool:
+        return bool(self._events) or self._overflowed or self.closed
+
+    def _take(self) -> list[bytes]:
+        if self.closed:
+            return None
+        if self._overflowed:
+            self._overflowed = False
+            return [RESYNC]
+        frames = list(self._events)
+        self._events.clear()
+        return frames
+
+    def get(self, timeout: float) -> list[bytes]:
+        """Frames queued so far, waiting up to timeout for the first; None once the subscription is closed"""
+        with self._condition:
+            if not self._ready():
+                self._condition.wait(timeout)
+            return self._take()
+
+    async def get_async(self, timeout: float) -> list[bytes]:
+        """get() for coroutines: waits on the running event loop instead of blocking a thread"""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+
+        def wakeup():
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                # The loop has already been closed
+                pass
+
+        with self._condition:
+            if self._ready():
+                return self._take()
+            self._wakeup = wakeup
+        try:
+            await asyncio.wait_for(ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._condition:
+            self._wakeup = None
+            return self._take()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._notify()
+
+
+class EventHub:
+    def __init__(self, max_events: int = 256, max_subscriptions_per_user: int = 32):
+        self.max_events = max_events
+        self.max_subscriptions_per_user = max_subscriptions_per_user
+        self.published = 0
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: int, version: int = None) -> Subscription:
+        """Register a stream for user_id, whose client is up to date as of version;
+        None if the user already has max_subscriptions_per_user open"""
+        subscription = Subscription(user_id, self.max_events, version)
+        with self._lock:
+            subscriptions = self._subscriptions.setdefault(user_id, set())
+            if len(subscriptions) >= self.max_subscriptions_per_user:
+                return None
+            subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.close()
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def watching(self, user_id: int) -> bool:
+        """Whether user_id has an open stream, to skip building event data nobody will receive"""
+        return user_id in self._subscriptions
+
+    def publish(self, user_id: int, event: str, data, version: int = None) -> int:
+        """Queue an event for every open stream of user_id, version being the user version the change
+        was written at; returns how many streams it went to"""
+        if user_id not in self._subscriptions:
+            return 0
+        with self._lock:
+            targets = list(self._subscriptions.get(user_id, ()))
+        if not targets:
+            return 0
+        frame = encode_event(event, data)
+        for subscription in targets:
+            subscription.put(frame, version)
+        self.published += 1
+        return len(targets)
+
+    def close(self):
+        """End every open stream (e.g. at shutdown)"""
+        with self._lock:
+            subscriptions = [subscription for group in self._subscriptions.values() for subscription in group]
+            self._subscriptions.clear()
+        for subscription in subscriptions:
+            subscription.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._subscriptions),
+                "connections": sum(len(group) for group in self._subscriptions.values()),
+                "published": self.published
+            }
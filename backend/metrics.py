@@ -0,0 +1,118 @@
+"""In-process latency histograms exposed in the Prometheus text format.
+
+Each observation is a bisect into a fixed bucket list and two increments under
+a per-histogram lock, so the instrumentation can stay on under load. Request
+latency is labelled by route rule (not raw path), method and status; phase()
+and timed() record the internal stages of a request (session, auth, load_data,
+score, serialize) into a separate histogram.
+"""
+import bisect
+import functools
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Every Histogram created is rendered by render()
+_histograms = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_float(value: float) -> str:
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        _histograms.append(self)
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> list[str]:
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, counts, total in sorted(snapshot):
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{_format_float(bound)}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+
+request_duration = Histogram('queup_request_duration_seconds', 'Time spent handling HTTP requests.', ('route', 'method', 'status'))
+phase_duration = Histogram('queup_phase_duration_seconds', 'Time spent in internal request phases.', ('phase',))
+
+# Extra exporters: callables returning (name, type, help, value) tuples, e.g. cache sizes
+_collectors = []
+
+
+def register_collector(collector):
+    _collectors.append(collector)
+    return collector
+
+
+class phase:
+    """Context manager timing a block into phase_duration"""
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        phase_duration.observe(time.perf_counter() - self.start, self.name)
+        return False
+
+
+def timed(name: str):
+    """Decorator form of phase()"""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                phase_duration.observe(time.perf_counter() - start, name)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    lines = []
+    for histogram in _histograms:
+        lines += histogram.render()
+    for collector in _collectors:
+        for name, metric_type, help, value in collector():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {metric_type}', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
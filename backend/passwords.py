@@ -0,0 +1,65 @@
+"""bcrypt hashing on a small dedicated thread pool.
+
+Hashing is deliberately slow, so running it on request threads lets a burst of
+logins occupy every worker. PasswordHasher caps how many hashes run at once and
+how many may wait, and rejects the rest with HasherBusy instead of queueing
+without limit. bcrypt releases the GIL while hashing, so other requests keep
+being served in the meantime.
+"""
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+_COST = re.compile(r'^\$2[abxy]?\$(\d\d)\$')
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, max_workers: int = 2, max_pending: int = 16, timeout: float = 30.0):
+        self.rounds = rounds
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    def submit(self, fn, *args):
+        """Run fn on the hashing pool and return its Future; raises HasherBusy when the queue is full"""
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many password operations in progress, try again shortly")
+        try:
+            future = self._executor.submit(fn, *args)
+        except RuntimeError:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds)).decode('utf-8')
+
+    @staticmethod
+    def _verify(password: str, hashed: str) -> bool:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def submit_hash(self, password: str):
+        return self.submit(self._hash, password)
+
+    def submit_verify(self, password: str, hashed: str):
+        return self.submit(self._verify, password, hashed)
+
+    def hash(self, password: str) -> str:
+        return self.submit_hash(password).result(self.timeout)
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self.submit_verify(password, hashed).result(self.timeout)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """True when the stored hash was made with a different cost than the configured rounds"""
+        match = _COST.match(hashed)
+        return not match or int(match.group(1)) != self.rounds
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
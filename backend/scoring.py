@@ -0,0 +1,239 @@
+"""Batch priority scoring for TaskManager.
+
+Settings are flattened into per-type/per-difficulty tables once, and every task
+is scored in one pass against a single clock reading. With NumPy installed,
+larger task lists are packed into arrays (deadline/due as epoch microseconds and
+days, ranks, thresholds) and scored vectorised; otherwise a plain Python loop is
+used. Both reproduce score_one exactly, including tie order.
+
+A ScoringPlan holds the compiled tables (and the settings they came from) for
+one user's settings, so they are built once and shared by every TaskManager
+using those settings.
+"""
+import math
+from types import MappingProxyType
+from datetime import datetime, time, timedelta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Below this many tasks building NumPy arrays costs more than it saves
+NUMPY_MIN_TASKS = 512
+
+_NO_TYPE = (0, False, 0, 0)
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_DAY_US = 86400 * 1000000
+_DAY = timedelta(days=1)
+# Datetime-format urgency bonus is 10 points per hour, overdue penalty 100 points per hour
+_BONUS_STEP = timedelta(hours=0.1)
+_OVERDUE_STEP = timedelta(hours=0.01)
+
+
+def to_micros(value: datetime) -> int:
+    """Microseconds since the (naive) Unix epoch"""
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def from_micros(value: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=value)
+
+
+def compile_type_table(task_type_settings: dict) -> dict:
+    """name -> (rank score, datetime format, threshold days, threshold hours)"""
+    return {
+        name: (setting.priority_rank * 1000, setting.deadline_format == "datetime", setting.prioritize_when_days_left, setting.prioritize_when_days_left * 24)
+        for name, setting in task_type_settings.items()
+    }
+
+
+def compile_difficulty_table(difficulty_settings: dict) -> dict:
+    return {name: setting.priority_rank * 100 for name, setting in difficulty_settings.items()}
+
+
+class ScoringPlan:
+    """Immutable compiled form of a user's task type and difficulty settings.
+
+    key identifies the settings it was built from (see app.scoring_plan). The
+    setting objects it holds are shared with every user of the plan and must not
+    be modified; build a new plan instead.
+    """
+    __slots__ = ('key', 'task_type_settings', 'difficulty_settings', 'type_settings', 'difficulty_by_name', 'type_table', 'difficulty_table', 'deadline_formats')
+
+    def __init__(self, task_type_settings, difficulty_settings, key: str = None):
+        set_attribute = object.__setattr__
+        set_attribute(self, 'key', key)
+        set_attribute(self, 'task_type_settings', tuple(task_type_settings))
+        set_attribute(self, 'difficulty_settings', tuple(difficulty_settings))
+        set_attribute(self, 'type_settings', MappingProxyType({setting.name: setting for setting in self.task_type_settings}))
+        set_attribute(self, 'difficulty_by_name', MappingProxyType({setting.name: setting for setting in self.difficulty_settings}))
+        set_attribute(self, 'type_table', MappingProxyType(compile_type_table(self.type_settings)))
+        set_attribute(self, 'difficulty_table', MappingProxyType(compile_difficulty_table(self.difficulty_by_name)))
+        set_attribute(self, 'deadline_formats', MappingProxyType({name: setting.deadline_format for name, setting in self.type_settings.items()}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ScoringPlan is immutable")
+
+    def deadline_format(self, task_type: str) -> str:
+        return self.deadline_formats.get(task_type, "date")
+
+    def scores(self, tasks, now: datetime = None) -> list:
+        """Priority score of every task (lower sorts first), read against one clock reading"""
+        now = now or datetime.now()
+        if np is not None and len(tasks) >= NUMPY_MIN_TASKS:
+            return _score_numpy(tasks, self.type_table, self.difficulty_table, now).tolist()
+        return _score_python(tasks, self.type_table, self.difficulty_table, now)
+
+
+def urgent_from(deadline_us: int, is_datetime: bool, threshold_days) -> int:
+    """Epoch microseconds from which a task with this deadline counts as urgent.
+
+    Datetime-format types turn urgent threshold_days before the deadline to the
+    microsecond; date-format types at midnight threshold_days before the deadline's date.
+    """
+    if is_datetime:
+        return deadline_us - int(threshold_days * _DAY_US)
+    return (deadline_us // _DAY_US - math.floor(threshold_days)) * _DAY_US
+
+
+def transition_times(task_type: str, deadline_us: int, type_table: dict) -> tuple:
+    """(urgent_from, overdue_at) in epoch microseconds; a task is urgent at now >= urgent_from and
+    overdue at now > overdue_at (its deadline). urgent_from is None for types without settings."""
+    if deadline_us is None:
+        return None, None
+    type_entry = type_table.get(task_type)
+    if type_entry is None:
+        return None, deadline_us
+    return urgent_from(deadline_us, type_entry[1], type_entry[2]), deadline_us
+
+
+def score_one(task, type_table: dict, difficulty_table: dict, now: datetime, now_ordinal: int = None):
+    score = 0
+    deadline = task.deadline
+    type_entry = type_table.get(task.type)
+    is_datetime = False
+    if now_ordinal is None:
+        now_ordinal = now.toordinal()
+
+    if type_entry is not None:
+        rank_score, is_datetime, threshold_days, threshold_hours = type_entry
+        score += rank_score
+
+        if deadline:
+            if is_datetime:
+                time_left = (deadline - now).total_seconds() / 3600
+                if time_left <= threshold_hours:
+                    score -= 2000
+                    score -= int(max(0, (threshold_hours - time_left) * 10))
+            elif deadline.toordinal() - now_ordinal <= threshold_days:
+                score -= 2000
+
+    score += difficulty_table.get(task.difficulty, 0)
+
+    due = task.due
+    if due:
+        if is_datetime:
+            score += max(0, int((due - now).total_seconds() / 3600))
+        else:
+            score += max(0, due.toordinal() - now_ordinal) * 24
+
+    if deadline and now > deadline:
+        if is_datetime:
+            score -= int((now - deadline).total_seconds() / 3600 * 100)
+        else:
+            score -= (now_ordinal - deadline.toordinal()) * 2400
+
+    return score
+
+
+def next_score_change(task, type_table: dict, now: datetime) -> datetime:
+    """Earliest instant after now at which score_one(task) may change, or None if it never will.
+
+    Date-format scores only move at midnight and when the deadline passes. Datetime-format
+    scores step when the urgency window opens, every 6 minutes of urgency bonus, every
+    36 seconds overdue, and every whole hour the due date gets closer. The result may be
+    early (rescoring then just yields the same score) but is never late.
+    """
+    deadline = task.deadline
+    due = task.due
+    type_entry = type_table.get(task.type)
+    candidates = []
+
+    if type_entry is not None and type_entry[1]:
+        threshold_hours = type_entry[3]
+        if deadline:
+            urgent_from = deadline - timedelta(hours=threshold_hours)
+            if now < urgent_from:
+                candidates.append(urgent_from)
+            else:
+                candidates.append(urgent_from + (int((now - urgent_from) / _BONUS_STEP) + 1) * _BONUS_STEP)
+            if now <= deadline:
+                candidates.append(deadline)
+            else:
+                candidates.append(deadline + (int((now - deadline) / _OVERDUE_STEP) + 1) * _OVERDUE_STEP)
+        if due and due > now:
+            hours = int((due - now).total_seconds() / 3600)
+            if hours:
+                candidates.append(due - timedelta(hours=hours))
+    elif deadline or due:
+        candidates.append(datetime.combine(now.date() + _DAY, time.min))
+        if deadline and now <= deadline:
+            candidates.append(deadline)
+
+    if not candidates:
+        return None
+    return max(min(candidates), now + _MICROSECOND)
+
+
+def _score_python(tasks, type_table: dict, difficulty_table: dict, now: datetime) -> list:
+    now_ordinal = now.toordinal()
+    return [score_one(task, type_table, difficulty_table, now, now_ordinal) for task in tasks]
+
+
+def _score_numpy(tasks, type_table: dict, difficulty_table: dict, now: datetime):
+    now_us = to_micros(now)
+    now_day = now_us // _DAY_US
+
+    # Index small per-type/per-difficulty arrays by code; the last slot is "unknown"
+    type_index = {name: i for i, name in enumerate(type_table)}
+    type_columns = zip(*type_table.values(), _NO_TYPE)
+    type_codes = np.array([type_index.get(task.type, len(type_index)) for task in tasks], dtype=np.intp)
+    rank_score, datetime_format, threshold_days, threshold_hours = (np.array(column, dtype=np.float64)[type_codes] for column in type_columns)
+    known_type = type_codes < len(type_index)
+    datetime_format = datetime_format.astype(bool)
+    date_format = ~datetime_format
+
+    difficulty_index = {name: i for i, name in enumerate(difficulty_table)}
+    difficulty_values = np.array([*difficulty_table.values(), 0], dtype=np.float64)
+    difficulty_score = difficulty_values[np.array([difficulty_index.get(task.difficulty, len(difficulty_index)) for task in tasks], dtype=np.intp)]
+
+    has_deadline = np.array([task.deadline_us is not None for task in tasks], dtype=bool)
+    has_due = np.array([task.due_us is not None for task in tasks], dtype=bool)
+    deadline_us = np.array([task.deadline_us or 0 for task in tasks], dtype=np.int64)
+    due_us = np.array([task.due_us or 0 for task in tasks], dtype=np.int64)
+    deadline_day = deadline_us // _DAY_US
+    due_day = due_us // _DAY_US
+
+    score = rank_score.copy()
+
+    time_left = (deadline_us - now_us) / 1000000 / 3600
+    urgent_datetime = known_type & has_deadline & datetime_format & (time_left <= threshold_hours)
+    score -= np.where(urgent_datetime, 2000 + np.trunc(np.maximum(0, (threshold_hours - time_left) * 10)), 0.0)
+
+    urgent_date = known_type & has_deadline & date_format & (deadline_day - now_day <= threshold_days)
+    score -= np.where(urgent_date, 2000, 0.0)
+
+    score += difficulty_score
+
+    hours_until_due = np.trunc((due_us - now_us) / 1000000 / 3600)
+    score += np.where(has_due & datetime_format, np.maximum(0, hours_until_due), 0.0)
+    score += np.where(has_due & date_format, np.maximum(0, due_day - now_day) * 24, 0.0)
+
+    overdue = has_deadline & (deadline_us < now_us)
+    hours_overdue = (now_us - deadline_us) / 1000000 / 3600
+    score -= np.where(overdue & datetime_format, np.trunc(hours_overdue * 100), 0.0)
+    score -= np.where(overdue & date_format, (now_day - deadline_day) * 2400, 0.0)
+
+    return score
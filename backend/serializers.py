@@ -0,0 +1,80 @@
+"""Serialization of tasks and settings, shared by the API and the database layer.
+
+dumps() writes straight to bytes with orjson when it is installed and falls back
+to the standard json module otherwise. iter_json_array() produces a JSON array
+in chunks so large listings can be streamed without building the whole payload.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Items per chunk yielded by iter_json_array
+STREAM_CHUNK_SIZE = 256
+
+
+def task_to_dict(task) -> dict:
+    return {
+        'id': task.id,
+        'title': task.title,
+        'category': task.category,
+        'type': task.type,
+        'difficulty': task.difficulty,
+        'note': task.note,
+        'due': task.iso('due'),
+        'deadline': task.iso('deadline'),
+        'complete': task.complete,
+        'completed_at': task.iso('completed_at')
+    }
+
+
+def task_type_setting_to_dict(setting) -> dict:
+    return {
+        "name": setting.name,
+        "default_due_days_before_deadline": setting.default_due_days_before_deadline,
+        "prioritize_when_days_left": setting.prioritize_when_days_left,
+        "deadline_format": setting.deadline_format,
+        "priority_rank": setting.priority_rank
+    }
+
+
+def difficulty_setting_to_dict(setting) -> dict:
+    return {"name": setting.name, "priority_rank": setting.priority_rank}
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def iter_json_array(items, to_dict=task_to_dict):
+    """Yield a JSON array of to_dict(item) as byte chunks of STREAM_CHUNK_SIZE items"""
+    yield b'['
+    chunk = []
+    first = True
+    for item in items:
+        chunk.append(to_dict(item))
+        if len(chunk) == STREAM_CHUNK_SIZE:
+            encoded = dumps(chunk)[1:-1]
+            yield encoded if first else b',' + encoded
+            first = False
+            chunk = []
+    if chunk:
+        encoded = dumps(chunk)[1:-1]
+        yield encoded if first else b',' + encoded
+    yield b']'
+
+
+def iter_ndjson(items, to_dict=task_to_dict):
+    """Yield one JSON document per line"""
+    for item in items:
+        yield dumps(to_dict(item)) + b'\n'
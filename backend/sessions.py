@@ -0,0 +1,129 @@
+"""Server-side sessions kept in the database (or a bounded in-memory store).
+
+The cookie carries only a signed random session id. Opening a session is one
+primary-key read, and nothing is written unless the session changed or its
+expiry is more than half used up. Anonymous requests never create a row.
+Expired rows are deleted in small batches, at most once per sweep_interval,
+piggybacked on session writes.
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+import serializers
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid: str = None, expires_at: float = None):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.modified = False
+
+
+class MemorySessionStore:
+    """Least-recently-used sessions for single-process deployments; same interface as database's session methods"""
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_session(self, session_id: str, now: float):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[1] <= now:
+                return None
+            self._sessions.move_to_end(session_id)
+            return entry
+
+    def save_session(self, session_id: str, data: str, expires_at: float):
+        with self._lock:
+            self._sessions[session_id] = (data, expires_at)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+
+    def delete_session(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def delete_expired_sessions(self, now: float, limit: int = 500) -> int:
+        with self._lock:
+            expired = [session_id for session_id, (_, expires_at) in self._sessions.items() if expires_at <= now][:limit]
+            for session_id in expired:
+                del self._sessions[session_id]
+        return len(expired)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    salt = 'queup-session'
+
+    def __init__(self, store, sweep_interval: float = 60.0, sweep_batch: int = 500):
+        """store is a database or MemorySessionStore; lifetime comes from PERMANENT_SESSION_LIFETIME"""
+        self.store = store
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self._next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    def _signer(self, app) -> Signer:
+        return Signer(app.secret_key, salt=self.salt, key_derivation='hmac')
+
+    def open_session(self, app, request) -> ServerSession:
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie or not app.secret_key:
+            return ServerSession()
+        try:
+            sid = self._signer(app).unsign(cookie).decode('ascii')
+        except (BadSignature, UnicodeDecodeError):
+            return ServerSession()
+        row = self.store.get_session(sid, time.time())
+        if row is None:
+            return ServerSession()
+        return ServerSession(serializers.loads(row[0]), sid, row[1])
+
+    def save_session(self, app, session: ServerSession, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.sid is not None and session.modified:
+                self.store.delete_session(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        if not session.modified and session.expires_at is not None and session.expires_at - now > lifetime / 2:
+            return
+
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        session.expires_at = now + lifetime
+        self.store.save_session(session.sid, serializers.dumps(dict(session)).decode('utf-8'), session.expires_at)
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode('ascii'),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+        self._maybe_sweep(now)
+
+    def _maybe_sweep(self, now: float):
+        if now < self._next_sweep or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = now + self.sweep_interval
+            self.store.delete_expired_sessions(now, self.sweep_batch)
+        finally:
+            self._sweep_lock.release()
@@ -0,0 +1,403 @@
+"""Users spread over several SQLite files, so writes for different users don't queue on one writer lock.
+
+    DB_SHARDS=4 python api.py
+
+ShardedDatabase stands in for app.database. Each user lives wholly in one
+shard, picked from the user id by shard_for(). Everything about a user (row,
+tasks, search index, stored transitions, version) therefore stays in a single
+file, and every per-user query runs unchanged against that file. Shard 0 is
+the database file itself (tasks.db); the others sit next to it as
+tasks.shard1.db, tasks.shard2.db and so on.
+
+A small directory file (tasks.directory.db) hands out user ids, so ids stay
+unique across shards. It maps usernames and emails to ids, which is how
+username-addressed calls and login find their shard. It also holds the
+sessions table and the shard count the files were laid out for.
+
+The layout is fixed while servers run. To go from an unsharded tasks.db to N
+shards, or from one shard count to another, stop every server and run
+
+    python shards.py --database tasks.db --shards N
+
+which moves users to their new shards and rebuilds the directory. It can be
+re-run after an interruption.
+"""
+import argparse
+import functools
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+from datetime import datetime
+from app import database
+
+
+def shard_for(user_id: int, shards: int) -> int:
+    """Shard index of user_id: a jump consistent hash, so going from n to n + 1 shards moves only 1/(n + 1) of users"""
+    key = int.from_bytes(hashlib.blake2b(int(user_id).to_bytes(8, 'big', signed=True), digest_size=8).digest(), 'big')
+    bucket, jump = -1, 0
+    while jump < shards:
+        bucket = jump
+        key = (key * 2862933555777866261 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_path(db_name: str, index: int) -> str:
+    if index == 0:
+        return db_name
+    stem, suffix = os.path.splitext(db_name)
+    return f'{stem}.shard{index}{suffix}'
+
+
+def directory_path(db_name: str) -> str:
+    stem, suffix = os.path.splitext(db_name)
+    return f'{stem}.directory{suffix}'
+
+
+def existing_shards(db_name: str) -> list[int]:
+    """Indexes of the shard files present on disk"""
+    stem, suffix = os.path.splitext(os.path.basename(db_name))
+    pattern = re.compile(re.escape(stem) + r'\.shard([1-9][0-9]*)' + re.escape(suffix) + '$')
+    found = {int(match.group(1)) for match in map(pattern.match, os.listdir(os.path.dirname(db_name) or '.')) if match}
+    return sorted(found | ({0} if os.path.exists(db_name) else set()))
+
+
+class Directory(database):
+    """The directory file: global user ids with their usernames and emails, the shard layout, and sessions"""
+    def _create_tables(self):
+        cursor = self.get_cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_directory (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL UNIQUE,
+                email TEXT NOT NULL UNIQUE
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shard_layout (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                shards INTEGER NOT NULL
+            )
+        ''')
+        self._create_session_table(cursor)
+        self.search_enabled = False
+        self.connection.commit()
+
+    def shard_count(self) -> int:
+        """The shard count the users were laid out for, or None before the first layout"""
+        cursor = self.get_cursor()
+        cursor.execute('SELECT shards FROM shard_layout')
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def set_shard_count(self, shards: int):
+        def upsert(cursor):
+            cursor.execute('INSERT INTO shard_layout (id, shards) VALUES (0, ?) ON CONFLICT (id) DO UPDATE SET shards = excluded.shards', (shards,))
+        self._write(upsert)
+
+    def register(self, username: str, email: str) -> int:
+        """Allocate the id of a new user; raises sqlite3.IntegrityError if the username or email is taken"""
+        def insert(cursor):
+            cursor.execute('INSERT INTO user_directory (username, email) VALUES (?, ?) RETURNING id', (username, email))
+            return cursor.fetchall()[0][0]
+        return self._write(insert)
+
+    def unregister(self, user_id: int):
+        self._write(lambda cursor: cursor.execute('DELETE FROM user_directory WHERE id = ?', (user_id,)))
+
+    def set_email(self, username: str, email: str):
+        self._write(lambda cursor: cursor.execute('UPDATE user_directory SET email = ? WHERE username = ?', (email, username)))
+
+    def user_id(self, username: str) -> int:
+        cursor = self.get_cursor()
+        cursor.execute('SELECT id FROM user_directory WHERE username = ?', (username,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def user_id_by_email(self, email: str) -> int:
+        cursor = self.get_cursor()
+        cursor.execute('SELECT id FROM user_directory WHERE email = ?', (email,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def _by_user_id(method):
+    """A ShardedDatabase method running the database method on the shard of its first argument, a user id"""
+    @functools.wraps(method)
+    def routed(self, user_id: int, *args, **kwargs):
+        return method(self.shard(user_id), user_id, *args, **kwargs)
+    return routed
+
+
+def _by_username(method):
+    """A ShardedDatabase method running the database method on the shard of its first argument, a username"""
+    @functools.wraps(method)
+    def routed(self, username: str, *args, **kwargs):
+        return method(self.shard_of(username), username, *args, **kwargs)
+    return routed
+
+
+class ShardedDatabase:
+    def __init__(self, db_name: str, shards: int = None, **options):
+        """shards defaults to the count recorded in the directory; options are passed to every app.database
+        (so each shard gets its own connection pool and, with group_commit, its own writer thread)"""
+        if db_name == ":memory:":
+            raise ValueError("Sharding needs a database file")
+        self.db_name = db_name
+        self.tracer = options.get('tracer')
+        self.directory = Directory(directory_path(db_name), **options)
+        self.shards = []
+        try:
+            recorded = self.directory.shard_count()
+            shards = shards or recorded
+            if not shards:
+                raise ValueError(f"No shard count given and none recorded for {db_name}")
+            if recorded is not None and recorded != shards:
+                raise ValueError(f"{db_name} is laid out for {recorded} shards, not {shards}; stop the servers and run `python shards.py --database {db_name} --shards {shards}`")
+            for index in range(shards):
+                self.shards.append(database(shard_path(db_name, index), **options))
+            if recorded is None:
+                if any(shard.get_cursor().execute('SELECT 1 FROM users LIMIT 1').fetchone() for shard in self.shards):
+                    raise ValueError(f"{db_name} already has users; run `python shards.py --database {db_name} --shards {shards}` to shard it")
+                self.directory.set_shard_count(shards)
+        except BaseException:
+            self.release()
+            self.close()
+            raise
+        self.release()
+        self.search_enabled = all(shard.search_enabled for shard in self.shards)
+
+    def shard(self, user_id: int) -> database:
+        return self.shards[shard_for(user_id, len(self.shards))]
+
+    def shard_of(self, username: str) -> database:
+        """The shard holding username; shard 0 for unknown users, where the call then fails as it would unsharded"""
+        user_id = self.directory.user_id(username)
+        return self.shard(user_id) if user_id is not None else self.shards[0]
+
+    def _all(self) -> list[database]:
+        return [self.directory, *self.shards]
+
+    def release(self):
+        for db in self._all():
+            db.release()
+
+    def flush(self):
+        for db in self._all():
+            db.flush()
+
+    def close(self):
+        for db in self._all():
+            db.close()
+
+    def data_generation(self, user_id: int = None) -> int:
+        """The data_generation() of user_id's shard, or of all shards summed"""
+        if user_id is not None:
+            return self.shard(user_id).data_generation()
+        return sum(shard.data_generation() for shard in self.shards)
+
+    def add_user(self, username: str, password: str, email: str):
+        try:
+            user_id = self.directory.register(username, email)
+        except sqlite3.IntegrityError as e:
+            if 'user_directory.email' in str(e):
+                return {"success": False, "response": "Email already exists"}
+            if 'user_directory.username' in str(e):
+                return {"success": False, "response": "Username already exists"}
+            return {"success": False, "response": "User already exists."}
+        except sqlite3.Error as e:
+            return {"success": False, "response": f"An error occurred: {e}"}
+        result = None
+        try:
+            result = self.shard(user_id).add_user(username, password, email, user_id=user_id)
+            return result
+        finally:
+            if not (result and result["success"]):
+                self.directory.unregister(user_id)
+
+    def get_user(self, username: str):
+        user_id = self.directory.user_id(username)
+        return self.shard(user_id).get_user_by_id(user_id) if user_id is not None else None
+
+    def get_user_by_email(self, email: str):
+        user_id = self.directory.user_id_by_email(email)
+        return self.shard(user_id).get_user_by_id(user_id) if user_id is not None else None
+
+    def update_user(self, username: str, password: str = None, email: str = None):
+        if email:
+            # The directory's UNIQUE constraint is the one that spans shards, so it goes first
+            self.directory.set_email(username, email)
+        self.shard_of(username).update_user(username, password, email)
+
+    def delete_user(self, username: str):
+        user_id = self.directory.user_id(username)
+        if user_id is None:
+            return
+        self.shard(user_id).delete_user(username)
+        self.directory.unregister(user_id)
+
+    def next_transition(self, now: datetime, user_id: int = None) -> datetime:
+        if user_id is not None:
+            return self.shard(user_id).next_transition(now, user_id)
+        return min(filter(None, (shard.next_transition(now) for shard in self.shards)), default=None)
+
+    def rebuild_search_index(self):
+        for shard in self.shards:
+            shard.rebuild_search_index()
+
+    get_user_by_id = _by_user_id(database.get_user_by_id)
+    get_user_version = _by_user_id(database.get_user_version)
+    get_tasks_by_user_id = _by_user_id(database.get_tasks_by_user_id)
+    get_task_ids = _by_user_id(database.get_task_ids)
+    get_completed_tasks_page = _by_user_id(database.get_completed_tasks_page)
+    iter_completed_tasks = _by_user_id(database.iter_completed_tasks)
+    get_urgent_task_ids = _by_user_id(database.get_urgent_task_ids)
+    get_overdue_task_ids = _by_user_id(database.get_overdue_task_ids)
+    get_transitions = _by_user_id(database.get_transitions)
+    search_tasks = _by_user_id(database.search_tasks)
+
+    get_user_tasks = _by_username(database.get_user_tasks)
+    add_task_to_user = _by_username(database.add_task_to_user)
+    add_tasks_to_user = _by_username(database.add_tasks_to_user)
+    remove_task_from_user = _by_username(database.remove_task_from_user)
+    remove_tasks_from_user = _by_username(database.remove_tasks_from_user)
+    mark_task_complete = _by_username(database.mark_task_complete)
+    mark_tasks_complete = _by_username(database.mark_tasks_complete)
+    get_user_task_types = _by_username(database.get_user_task_types)
+    get_user_task_difficulties = _by_username(database.get_user_task_difficulties)
+    update_user_task_types = _by_username(database.update_user_task_types)
+    update_user_task_difficulties = _by_username(database.update_user_task_difficulties)
+    update_user_task_type_settings = _by_username(database.update_user_task_type_settings)
+    update_user_difficulty_settings = _by_username(database.update_user_difficulty_settings)
+
+    def get_session(self, session_id: str, now: float):
+        return self.directory.get_session(session_id, now)
+
+    def save_session(self, session_id: str, data: str, expires_at: float):
+        self.directory.save_session(session_id, data, expires_at)
+
+    def delete_session(self, session_id: str):
+        self.directory.delete_session(session_id)
+
+    def delete_expired_sessions(self, now: float, limit: int = 500) -> int:
+        return self.directory.delete_expired_sessions(now, limit)
+
+
+def recorded_shards(db_name: str) -> int:
+    """The shard count in db_name's directory, or None if it was never sharded"""
+    path = directory_path(db_name)
+    if not os.path.exists(path):
+        return None
+    connection = sqlite3.connect(path)
+    try:
+        row = connection.execute('SELECT shards FROM shard_layout').fetchone()
+        return row[0] if row else None
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        connection.close()
+
+
+def open_database(db_name: str, shards: int = None, **options):
+    """app.database for db_name, or a ShardedDatabase once it has been sharded or shards > 1 is asked for"""
+    if shards is not None and shards < 1:
+        raise ValueError("shards must be at least 1")
+    if (shards or 1) == 1 and recorded_shards(db_name) is None:
+        return database(db_name, **options)
+    return ShardedDatabase(db_name, shards, **options)
+
+
+def _columns(cursor, table: str) -> list[str]:
+    cursor.execute(f'PRAGMA table_info({table})')
+    return [row[1] for row in cursor.fetchall()]
+
+
+def _move_user(source: database, target: database, user_id: int):
+    """Copy a user's row and tasks into target in one transaction, then delete them from source.
+    A copy left behind by an interrupted run is replaced, so moving again is safe."""
+    cursor = target.get_cursor()
+    user_columns = _columns(cursor, 'users')
+    task_columns = _columns(cursor, 'tasks')
+    source_cursor = source.get_cursor()
+    source_cursor.execute(f'SELECT {", ".join(user_columns)} FROM users WHERE id = ?', (user_id,))
+    user = source_cursor.fetchone()
+    source_cursor.execute(f'SELECT {", ".join(task_columns)} FROM tasks WHERE user_id = ?', (user_id,))
+    tasks = source_cursor.fetchall()
+
+    cursor.execute('DELETE FROM tasks WHERE user_id = ?', (user_id,))
+    cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+    cursor.execute(f'INSERT INTO users ({", ".join(user_columns)}) VALUES ({", ".join("?" * len(user_columns))})', user)
+    cursor.executemany(f'INSERT INTO tasks ({", ".join(task_columns)}) VALUES ({", ".join("?" * len(task_columns))})', tasks)
+    target.connection.commit()
+
+    source_cursor.execute('DELETE FROM tasks WHERE user_id = ?', (user_id,))
+    source_cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+    source.connection.commit()
+
+
+def rebalance(db_name: str, shards: int, log=print) -> dict:
+    """Lay db_name out over shards files: move every user to shard_for(id, shards), rebuild the directory
+    from the shards' users tables, move sessions into it and record the new count. Servers must be stopped."""
+    if shards < 1:
+        raise ValueError("shards must be at least 1")
+    indexes = sorted(set(existing_shards(db_name)) | set(range(shards)))
+    files = {index: database(shard_path(db_name, index), pool_size=0) for index in indexes}
+    directory = Directory(directory_path(db_name), pool_size=0)
+    moved = 0
+    try:
+        for index, source in files.items():
+            cursor = source.get_cursor()
+            cursor.execute('SELECT id FROM users ORDER BY id')
+            for (user_id,) in cursor.fetchall():
+                target = shard_for(user_id, shards)
+                if target != index:
+                    _move_user(source, files[target], user_id)
+                    moved += 1
+            log(f"{shard_path(db_name, index)}: {moved} users moved so far")
+
+        entries = []
+        sessions = []
+        for index, shard in files.items():
+            cursor = shard.get_cursor()
+            if index < shards:
+                cursor.execute('SELECT id, username, email FROM users')
+                entries.extend(cursor.fetchall())
+            cursor.execute('SELECT id, data, expires_at FROM sessions')
+            sessions.extend(cursor.fetchall())
+
+        cursor = directory.get_cursor()
+        # Explicit ids keep AUTOINCREMENT's counter above every id ever used, so new users never reuse one
+        cursor.execute('DELETE FROM user_directory')
+        cursor.executemany('INSERT INTO user_directory (id, username, email) VALUES (?, ?, ?)', entries)
+        cursor.executemany('INSERT OR IGNORE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)', sessions)
+        cursor.execute('INSERT INTO shard_layout (id, shards) VALUES (0, ?) ON CONFLICT (id) DO UPDATE SET shards = excluded.shards', (shards,))
+        directory.connection.commit()
+        for shard in files.values():
+            shard.get_cursor().execute('DELETE FROM sessions')
+            shard.connection.commit()
+    finally:
+        for db in [directory, *files.values()]:
+            db.close()
+
+    for index in indexes:
+        if index >= shards:
+            log(f"{shard_path(db_name, index)} is no longer used and holds no users; it can be deleted")
+    return {"shards": shards, "users": len(entries), "moved": moved, "sessions": len(sessions)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move users between shard files for a new shard count (servers must be stopped)")
+    parser.add_argument('--database', default='tasks.db', help="shard 0, which the other files are named after")
+    parser.add_argument('--shards', type=int, required=True)
+    args = parser.parse_args()
+    try:
+        result = rebalance(args.database, args.shards)
+    except (ValueError, sqlite3.Error) as e:
+        sys.exit(f"Rebalance failed: {e}")
+    print(f"{result['users']} users over {result['shards']} shards ({result['moved']} moved, {result['sessions']} sessions moved into the directory)")
+
+
+if __name__ == '__main__':
+    main()
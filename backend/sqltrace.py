@@ -0,0 +1,159 @@
+"""Optional instrumentation for the cursors handed out by database.get_cursor().
+
+A QueryTracer wraps each cursor in a TracedCursor that times every statement
+and counts rows read (fetched) and written (rowcount). Counters are kept per
+request, between begin() and end() on the current thread, and in running
+totals. Statements slower than slow_threshold are logged together with their
+EXPLAIN QUERY PLAN. The per-request statement counts are how repeated lookups
+(N+1 patterns) show up.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger("queup.sql")
+
+
+def normalize(sql: str) -> str:
+    return ' '.join(sql.split())
+
+
+class QueryStats:
+    __slots__ = ('queries', 'seconds', 'rows_read', 'rows_written', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.statements = Counter()
+
+    def repeated(self, min_count: int = 2) -> list[tuple[str, int]]:
+        """Statements run at least min_count times, most frequent first"""
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= min_count]
+
+    def as_dict(self) -> dict:
+        return {
+            "queries": self.queries,
+            "seconds": self.seconds,
+            "rows_read": self.rows_read,
+            "rows_written": self.rows_written
+        }
+
+
+class TracedCursor:
+    __slots__ = ('_cursor', '_tracer')
+
+    def __init__(self, cursor: sqlite3.Cursor, tracer: "QueryTracer"):
+        self._cursor = cursor
+        self._tracer = tracer
+
+    def execute(self, sql: str, parameters=()):
+        start = time.perf_counter()
+        self._cursor.execute(sql, parameters)
+        self._tracer._record(self._cursor, sql, parameters, time.perf_counter() - start)
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        self._cursor.executemany(sql, seq_of_parameters)
+        self._tracer._record(self._cursor, sql, seq_of_parameters[0] if seq_of_parameters else (), time.perf_counter() - start)
+        return self
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._tracer._rows_read(1)
+        return row
+
+    def fetchmany(self, size: int = None):
+        rows = self._cursor.fetchmany(size if size is not None else self._cursor.arraysize)
+        self._tracer._rows_read(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._tracer._rows_read(len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._tracer._rows_read(1)
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class QueryTracer:
+    def __init__(self, slow_threshold: float = 0.05, explain: bool = True):
+        """slow_threshold in seconds; explain=False logs slow statements without their query plan"""
+        self.slow_threshold = slow_threshold
+        self.explain = explain
+        self.totals = QueryStats()
+        self.slow_queries = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._normalized = {}
+
+    def wrap(self, cursor: sqlite3.Cursor) -> TracedCursor:
+        return TracedCursor(cursor, self)
+
+    def begin(self):
+        """Start counting queries made by the current thread (e.g. at the start of a request)"""
+        self._local.stats = QueryStats()
+
+    def end(self) -> QueryStats:
+        stats = getattr(self._local, 'stats', None)
+        self._local.stats = None
+        return stats
+
+    def current(self) -> QueryStats:
+        return getattr(self._local, 'stats', None)
+
+    def _normalize(self, sql: str) -> str:
+        normalized = self._normalized.get(sql)
+        if normalized is None:
+            normalized = self._normalized[sql] = normalize(sql)
+        return normalized
+
+    def _record(self, cursor: sqlite3.Cursor, sql: str, parameters, elapsed: float):
+        written = cursor.rowcount if cursor.rowcount > 0 else 0
+        statement = self._normalize(sql)
+        stats = getattr(self._local, 'stats', None)
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+            stats.rows_written += written
+            stats.statements[statement] += 1
+        with self._lock:
+            self.totals.queries += 1
+            self.totals.seconds += elapsed
+            self.totals.rows_written += written
+            if elapsed >= self.slow_threshold:
+                self.slow_queries += 1
+        if elapsed >= self.slow_threshold:
+            self._log_slow(cursor.connection, sql, statement, parameters, elapsed)
+
+    def _rows_read(self, count: int):
+        stats = getattr(self._local, 'stats', None)
+        if stats is not None:
+            stats.rows_read += count
+        with self._lock:
+            self.totals.rows_read += count
+
+    def query_plan(self, connection: sqlite3.Connection, sql: str, parameters=()) -> list[str]:
+        try:
+            return [row[-1] for row in connection.execute(f'EXPLAIN QUERY PLAN {sql}', parameters)]
+        except sqlite3.Error as e:
+            return [f"(no plan: {e})"]
+
+    def _log_slow(self, connection: sqlite3.Connection, sql: str, statement: str, parameters, elapsed: float):
+        if self.explain and statement.split(' ', 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+            plan = '; '.join(self.query_plan(connection, sql, parameters))
+        else:
+            plan = '-'
+        logger.warning("slow query (%.1f ms): %s | plan: %s", elapsed * 1000, statement, plan)
@@ -0,0 +1,131 @@
+"""Batch scoring must match TaskManager._calculate_priority_score, the scalar reference.
+
+    python -m pytest backend/test_scoring.py
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import scoring
+from app import Task, TaskManager, TaskTypeSettings, DifficultySettings
+from scoring import ScoringPlan, NUMPY_MIN_TASKS, _score_python, _score_numpy
+
+NOW = datetime(2026, 3, 14, 15, 9, 26, 535897)
+SIZES = (1, NUMPY_MIN_TASKS - 1, NUMPY_MIN_TASKS, 3 * NUMPY_MIN_TASKS)
+
+
+def random_plan(rng: random.Random) -> ScoringPlan:
+    """Two date and two datetime types, ranks drawn from a small range so ties are common"""
+    task_types = [
+        TaskTypeSettings(name, rng.randint(0, 7), rng.randint(0, 14), deadline_format, rng.randint(0, 2))
+        for name, deadline_format in (("Short term", "date"), ("Long term", "date"), ("Exam", "datetime"), ("Lab", "datetime"))
+    ]
+    difficulties = [DifficultySettings(name, rng.randint(0, 2)) for name in ("Easy", "Medium", "Hard")]
+    return ScoringPlan(task_types, difficulties)
+
+
+def random_time(rng: random.Random) -> datetime:
+    """Mostly within a few weeks of NOW either side (overdue, urgent and far off), sometimes on a whole day"""
+    moment = NOW + timedelta(days=rng.uniform(-30, 30))
+    if rng.random() < 0.3:
+        return datetime.combine(moment.date(), datetime.min.time())
+    return moment
+
+
+def random_tasks(rng: random.Random, count: int) -> list[Task]:
+    tasks = []
+    for i in range(count):
+        deadline = random_time(rng) if rng.random() < 0.95 else None
+        due = deadline - timedelta(hours=rng.uniform(0, 240)) if deadline and rng.random() < 0.9 else None
+        tasks.append(Task(
+            f"task {i}", "c",
+            rng.choice(("Short term", "Long term", "Exam", "Lab", "Unknown")),
+            due, deadline,
+            rng.choice(("Easy", "Medium", "Hard", None, "Unknown"))
+        ))
+    return tasks
+
+
+def reference_scores(tasks: list[Task], plan: ScoringPlan, now: datetime) -> list[int]:
+    manager = TaskManager([], plan=plan)
+    return [manager._calculate_priority_score(task, now) for task in tasks]
+
+
+def stable_order(scores: list) -> list[int]:
+    return sorted(range(len(scores)), key=scores.__getitem__)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("seed", range(5))
+def test_python_backend_matches_reference(seed, size):
+    rng = random.Random(seed)
+    plan = random_plan(rng)
+    tasks = random_tasks(rng, size)
+    expected = reference_scores(tasks, plan, NOW)
+    scores = _score_python(tasks, plan.type_table, plan.difficulty_table, NOW)
+    assert scores == expected
+    assert stable_order(scores) == stable_order(expected)
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("seed", range(5))
+def test_numpy_backend_matches_reference(seed, size):
+    pytest.importorskip("numpy")
+    rng = random.Random(seed)
+    plan = random_plan(rng)
+    tasks = random_tasks(rng, size)
+    expected = reference_scores(tasks, plan, NOW)
+    scores = _score_numpy(tasks, plan.type_table, plan.difficulty_table, NOW).tolist()
+    assert scores == expected
+    assert stable_order(scores) == stable_order(expected)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_plan_scores_match_reference_with_and_without_numpy(size, monkeypatch):
+    rng = random.Random(size)
+    plan = random_plan(rng)
+    tasks = random_tasks(rng, size)
+    expected = reference_scores(tasks, plan, NOW)
+    assert plan.scores(tasks, NOW) == expected
+    monkeypatch.setattr(scoring, "np", None)
+    assert plan.scores(tasks, NOW) == expected
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_priority_order_breaks_ties_by_list_order(size):
+    rng = random.Random(100 + size)
+    plan = random_plan(rng)
+    tasks = random_tasks(rng, size)
+    for task in tasks[::7]:
+        task.complete = True
+    incomplete = [task for task in tasks if not task.complete]
+    expected = reference_scores(incomplete, plan, NOW)
+    if size >= NUMPY_MIN_TASKS:
+        assert len(set(expected)) < len(expected), "the data should contain ties"
+    ordered = TaskManager(tasks, plan=plan).get_prioritized_tasks(NOW)
+    assert ordered == [incomplete[i] for i in stable_order(expected)]
+
+
+def test_index_follows_reference_as_time_passes_and_tasks_change():
+    rng = random.Random(7)
+    plan = random_plan(rng)
+    tasks = random_tasks(rng, 2 * NUMPY_MIN_TASKS)
+    manager = TaskManager(list(tasks), plan=plan)
+    now = NOW
+    manager.get_prioritized_tasks(now)
+    for step in range(40):
+        now += timedelta(minutes=rng.choice((1, 7, 36, 360, 1440)))
+        action = rng.random()
+        if action < 0.3:
+            manager.add_task(random_tasks(rng, 1)[0])
+        elif action < 0.6:
+            manager.mark_complete(rng.choice(manager.tasks), rng.random() < 0.7)
+        elif action < 0.7:
+            manager.delete_task(rng.choice(manager.tasks).id)
+        elif action < 0.8:
+            doomed = [task.id for task in rng.sample(manager.tasks, 5)] + ["missing"]
+            assert manager.delete_tasks(doomed) == 5
+        incomplete = [task for task in manager.tasks if not task.complete]
+        expected = reference_scores(incomplete, plan, now)
+        assert manager.get_prioritized_tasks(now) == [incomplete[i] for i in stable_order(expected)], f"step {step}"
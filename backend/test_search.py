@@ -0,0 +1,51 @@
+"""Full-text search must stay within the user's own tasks and only match their titles and notes.
+
+    python -m pytest backend/test_search.py
+"""
+import pytest
+
+from app import database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = database(str(tmp_path / "search.db"))
+    if not db.search_enabled:
+        pytest.skip("SQLite was built without FTS5")
+    yield db
+    db.close()
+
+
+def add_user(db: database, name: str, titles: list[tuple]) -> int:
+    db.add_user(name, "password", f"{name}@example.com")
+    user_id = db.get_user(name)["id"]
+    for title, note in titles:
+        db._write(lambda cursor: cursor.execute(
+            'INSERT INTO tasks (id, user_id, title, category, type, note, due, deadline, complete) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)',
+            (f"{name}-{title}", user_id, title, "c", "Short term", note, "2030-01-01T00:00:00", "2030-01-01T00:00:00")
+        ))
+    return user_id
+
+
+def titles(tasks) -> set[str]:
+    return {task.title for task in tasks}
+
+
+def test_terms_do_not_match_the_user_id_column(db):
+    first = add_user(db, "first", [("groceries", None), ("release 1", None), ("essay", "chapter 1 draft")])
+    twelfth = add_user(db, "twelfth", [("laundry", None)])
+    db._write(lambda cursor: cursor.execute('UPDATE users SET id = 12 WHERE id = ?', (twelfth,)))
+    db._write(lambda cursor: cursor.execute('UPDATE tasks SET user_id = 12 WHERE user_id = ?', (twelfth,)))
+    assert first == 1
+    assert titles(db.search_tasks(1, ["1"], 10)) == {"release 1", "essay"}
+    assert titles(db.search_tasks(12, ["1"], 10)) == set()
+    assert titles(db.search_tasks(12, ["12"], 10)) == set()
+
+
+def test_search_only_returns_the_users_own_tasks(db):
+    first = add_user(db, "first", [("biology exam", None)])
+    second = add_user(db, "second", [("biology lab", "bring goggles")])
+    assert titles(db.search_tasks(first, ["bio"], 10)) == {"biology exam"}
+    assert titles(db.search_tasks(second, ["bio"], 10)) == {"biology lab"}
+    assert titles(db.search_tasks(second, ["goggles"], 10)) == {"biology lab"}
+    assert db.search_tasks(first, ["goggles"], 10) == []
@@ -0,0 +1,125 @@
+"""In-process cache of hydrated User objects.
+
+Authenticated requests look the user up here instead of re-reading their row,
+re-parsing the settings and rebuilding every Task. Writes made through a cached
+User update it in place; failed writes, or writes made through a different
+instance, drop the entry so the next request reloads it from the database.
+
+A cached User is shared by every concurrent request for that user, so it is
+only safe because User serializes all access to its TaskManager, reads
+included (a read may rebuild or re-key the priority index), on User._lock.
+Code using a cached User goes through its methods and never reaches into
+user.taskManager or mutates the lists it gets back.
+
+Entries also stay coherent with writes from other processes (several workers
+on one SQLite file) or other tools. Each entry remembers the database's
+data_generation() at which it was last known to be current. While that
+counter doesn't move, a hit costs one PRAGMA. Once it moves, the entry is
+checked against users.version (one primary-key read) and reloaded only if
+someone else changed that user. With sharded storage the counter is that of the
+user's own shard, so writes to other shards never cost a revalidation. A User tracks its own writes' versions, so
+writes made through it never count as foreign.
+"""
+import threading
+import time
+from collections import OrderedDict
+from app import database, User
+
+
+class UserCache:
+    def __init__(self, db: database, max_size: int = 1024, ttl: float = 300.0, coherent: bool = True):
+        """max_size=0 disables caching; entries older than ttl seconds are reloaded;
+        coherent=False skips the cross-process checks (for a single process that is the only writer)"""
+        self.db = db
+        self.max_size = max_size
+        self.ttl = ttl
+        self.coherent = coherent
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+        self.stale = 0
+
+    def get(self, user_id: int) -> User:
+        """Return the cached User, loading it on a miss, or None if the user doesn't exist"""
+        now = time.monotonic()
+        generation = self.db.data_generation(user_id) if self.coherent else None
+        cached = None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and now - entry[1] < self.ttl:
+                if entry[2] == generation:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return entry[0]
+                cached = entry[0]
+
+        if cached is not None:
+            current = cached.version is not None and self.db.get_user_version(user_id) == cached.version
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if current and entry and entry[0] is cached:
+                    self._entries[user_id] = (cached, entry[1], generation)
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    self.revalidations += 1
+                    return cached
+                self.stale += 1
+
+        with self._lock:
+            self.misses += 1
+        try:
+            user = User(user_id, self.db)
+        except ValueError:
+            self.invalidate(user_id)
+            return None
+        return self._put(user, now, generation)
+
+    def _put(self, user: User, loaded_at: float, generation: int = None) -> User:
+        if self.max_size <= 0:
+            return user
+        with self._lock:
+            entry = self._entries.get(user.user_id)
+            if entry and entry[0] is not user and entry[2] == generation and time.monotonic() - entry[1] < self.ttl:
+                # Another request loaded this user concurrently; share its instance
+                return entry[0]
+            user.cache = self
+            self._entries[user.user_id] = (user, loaded_at, generation)
+            self._entries.move_to_end(user.user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return user
+
+    def written(self, user: User, result: dict):
+        """Called by User after each write; keeps the entry only if it is the instance that was written
+        and the write's version follows directly on the one it was loaded at (no foreign write in between)"""
+        version = result.get("version")
+        if version is not None:
+            user.version = version if user.version is not None and version == user.version + 1 else None
+        with self._lock:
+            entry = self._entries.get(user.user_id)
+            if entry and (not result["success"] or entry[0] is not user or user.version is None):
+                del self._entries[user.user_id]
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "revalidations": self.revalidations,
+                "stale": self.stale
+            }
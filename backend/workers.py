@@ -0,0 +1,111 @@
+"""Prefork launcher: several worker processes serving api.app on one port and one SQLite file.
+
+    python workers.py --workers 4 --port 5001
+
+The parent process creates (and migrates) the database, opens the listening
+socket and forks the workers. Each worker then imports api on its own, so no
+SQLite connection, thread pool or cache is ever shared across a fork. The
+kernel spreads incoming connections over the workers, and each serves them
+with a threaded WSGI server. Workers that die are replaced.
+
+Per-process caches stay coherent through the database (see user_cache.py and
+events.py). Sessions must therefore live in the database too:
+SESSION_STORE=memory is refused.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+
+# The file api.py opens (shard 0 when sharded)
+DATABASE = 'tasks.db'
+
+
+def serve(listener: socket.socket):
+    """Worker body: import the app after the fork and serve the inherited socket until SIGTERM"""
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from werkzeug.serving import make_server
+    import api
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, api.app, threaded=True, fd=listener.fileno())
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        api.cleanup_resources()
+
+
+def spawn(listener: socket.socket) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            serve(listener)
+        except SystemExit as e:
+            code = e.code or 0
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        finally:
+            # Never return into the parent's code (or run its atexit handlers)
+            os._exit(code)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args()
+
+    if os.environ.get('SESSION_STORE') == 'memory':
+        sys.exit("SESSION_STORE=memory keeps sessions in one process; unset it to run several workers")
+
+    # Create and migrate the schema (of every shard, with DB_SHARDS) once, rather than in every worker at the same time
+    from shards import open_database
+    try:
+        open_database(DATABASE, shards=int(os.environ.get('DB_SHARDS', 0)) or None).close()
+    except ValueError as e:
+        sys.exit(str(e))
+
+    listener = socket.create_server((args.host, args.port), backlog=1024)
+    listener.set_inheritable(True)
+
+    workers = {spawn(listener) for _ in range(args.workers)}
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Serving on {args.host}:{args.port} with {len(workers)} workers")
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited ({status}), starting a replacement", file=sys.stderr)
+            time.sleep(0.5)
+            workers.add(spawn(listener))
+    listener.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Group commit for database writes.
+
+With group commit enabled, database write methods hand their SQL (a function
+of a cursor) to a single writer thread instead of committing on the request
+thread. The writer runs whatever is queued, up to max_batch writes or max_delay
+seconds after the first, inside one transaction. Each write gets its own
+savepoint, so a failing write is rolled back alone. The writer then commits
+once and resolves every write's Future. Callers that need durability wait on
+the Future (through result(), which gives up after result_timeout); the rest
+can move on. A batch that fails outside its writes' savepoints fails all of
+its Futures and the writer carries on with a fresh connection.
+"""
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+
+class RollbackWrite(Exception):
+    """Raised by a write function to discard its own changes and return result instead"""
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
+
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    def __init__(self, connect, wrap_cursor=None, max_batch: int = 64, max_delay: float = 0.005, max_pending: int = 1024, submit_timeout: float = 5.0,
+                 result_timeout: float = 30.0):
+        """connect() opens the writer's own connection; wrap_cursor (e.g. a QueryTracer's wrap) instruments its cursors"""
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.submit_timeout = submit_timeout
+        self.result_timeout = result_timeout
+        self.batches = 0
+        self.writes = 0
+        self.failed_batches = 0
+        self._connect = connect
+        self._wrap_cursor = wrap_cursor
+        self._queue = queue.Queue(max_pending)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn) -> Future:
+        """Queue fn(cursor) for the next group commit; blocks while the queue is full, up to submit_timeout"""
+        if self._closed:
+            raise sqlite3.OperationalError("Database writer is closed")
+        future = Future()
+        try:
+            self._queue.put((fn, future), timeout=self.submit_timeout)
+        except queue.Full:
+            raise sqlite3.OperationalError("Database write queue is full")
+        return future
+
+    def result(self, future: Future):
+        """Wait for a submitted write's result, up to result_timeout; one still queued by then is cancelled"""
+        try:
+            return future.result(self.result_timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise sqlite3.OperationalError("Database write timed out")
+            raise sqlite3.OperationalError("Database write timed out and may still commit")
+
+    def flush(self, timeout: float = None):
+        """Block until everything queued so far has been committed"""
+        if self._closed:
+            return
+        marker = Future()
+        self._queue.put((None, marker), timeout=timeout)
+        marker.result(timeout)
+
+    def close(self, timeout: float = None):
+        """Commit whatever is queued, then stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        connection = None
+        stopping = False
+        try:
+            while not stopping:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                try:
+                    if connection is None:
+                        connection = self._connect()
+                    self._commit(connection, batch)
+                except Exception as e:
+                    # Anything _commit didn't handle leaves the transaction in an unknown state
+                    self.failed_batches += 1
+                    for fn, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    connection = self._discard(connection)
+        finally:
+            self._discard(connection)
+
+    @staticmethod
+    def _discard(connection: sqlite3.Connection):
+        """Roll back and close connection, ignoring errors; returns None so the next batch reconnects"""
+        if connection is not None:
+            try:
+                connection.rollback()
+            except sqlite3.Error:
+                pass
+            connection.close()
+        return None
+
+    def _commit(self, connection: sqlite3.Connection, batch: list):
+        cursor = connection.cursor()
+        if self._wrap_cursor is not None:
+            cursor = self._wrap_cursor(cursor)
+        outcomes = []
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+        except sqlite3.Error as e:
+            for fn, future in batch:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+            return
+
+        for fn, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            if fn is None:
+                # flush() marker
+                outcomes.append((future, None, None))
+                continue
+            connection.execute('SAVEPOINT write')
+            try:
+                outcomes.append((future, fn(cursor), None))
+                connection.execute('RELEASE write')
+            except RollbackWrite as e:
+                connection.execute('ROLLBACK TO write')
+                connection.execute('RELEASE write')
+                outcomes.append((future, e.result, None))
+            except Exception as e:
+                connection.execute('ROLLBACK TO write')
+                connection.execute('RELEASE write')
+                outcomes.append((future, None, e))
+
+        try:
+            connection.commit()
+        except sqlite3.Error as e:
+            connection.rollback()
+            outcomes = [(future, None, error or e) for future, _, error in outcomes]
+        self.batches += 1
+        self.writes += sum(1 for fn, _ in batch if fn is not None)
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -1,5 +1,11 @@
 const API_BASE = 'https://someonecool.pythonanywhere.com/';
 let currentUser = null;
+let taskEvents = null;
+let reloadTimer = null;
+// Ids of tasks this page just changed; their events are echoes of our own requests, which already reload
+const ownChanges = new Set();
+const RELOAD_DELAY_MS = 250;
+const OWN_CHANGE_TTL_MS = 5000;
 
 function updateStatus(message) {
     document.getElementById('status').textContent = message;
@@ -58,6 +64,12 @@ async function logout() {
         
         updateStatus('Logged out');
         currentUser = null;
+        clearTimeout(reloadTimer);
+        reloadTimer = null;
+        if (taskEvents) {
+            taskEvents.close();
+            taskEvents = null;
+        }
     } catch (error) {
         updateStatus('Error: ' + error.message);
     }
@@ -73,6 +85,7 @@ async function getCurrentUser() {
             currentUser = await response.json();
             updateStatus(`Logged in as ${currentUser.username}`);
             loadTasks();
+            subscribeToTaskEvents();
         } else {
             updateStatus('Not logged in');
         }
@@ -81,6 +94,32 @@ async function getCurrentUser() {
     }
 }
 
+function subscribeToTaskEvents() {
+    // The server pushes changes and urgency transitions, so the list is only refetched when something happened
+    if (taskEvents) taskEvents.close();
+    taskEvents = new EventSource(`${API_BASE}/tasks/events`, { withCredentials: true });
+    ['added', 'completed', 'deleted', 'became-urgent', 'became-overdue', 'resync'].forEach(type => {
+        taskEvents.addEventListener(type, event => {
+            const id = JSON.parse(event.data).id;
+            if (ownChanges.delete(id)) return;
+            scheduleLoadTasks();
+        });
+    });
+}
+
+function expectOwnEvent(id) {
+    // Forget the id if its echo never comes (e.g. it arrived before our response did)
+    ownChanges.add(id);
+    setTimeout(() => ownChanges.delete(id), OWN_CHANGE_TTL_MS);
+}
+
+function scheduleLoadTasks() {
+    // A burst of events (a batch, several transitions at once) becomes one refetch
+    if (reloadTimer === null) {
+        reloadTimer = setTimeout(loadTasks, RELOAD_DELAY_MS);
+    }
+}
+
 async function addTask() {
     const title = document.getElementById('task-title').value;
     const category = document.getElementById('task-category').value;
@@ -100,6 +139,7 @@ async function addTask() {
         const data = await response.json();
         updateStatus(response.ok ? data.message : data.error);
         if (response.ok) {
+            expectOwnEvent(data.id);
             document.getElementById('task-title').value = '';
             document.getElementById('task-category').value = '';
             document.getElementById('task-note').value = '';
@@ -111,6 +151,8 @@ async function addTask() {
 }
 
 async function loadTasks() {
+    clearTimeout(reloadTimer);
+    reloadTimer = null;
     try {
         const response = await fetch(`${API_BASE}/tasks`, {
             credentials: 'include'
@@ -158,6 +200,7 @@ function displayTaskList(containerId, tasks, className) {
 }
 
 async function toggleComplete(taskId) {
+    expectOwnEvent(taskId);
     try {
         const response = await fetch(`${API_BASE}/tasks/complete/${taskId}`, {
             method: 'PUT',
@@ -167,12 +210,15 @@ async function toggleComplete(taskId) {
         const data = await response.json();
         updateStatus(response.ok ? data.message : data.error);
         if (response.ok) loadTasks();
+        else ownChanges.delete(taskId);
     } catch (error) {
+        ownChanges.delete(taskId);
         updateStatus('Error: ' + error.message);
     }
 }
 
 async function deleteTask(taskId) {
+    expectOwnEvent(taskId);
     try {
         const response = await fetch(`${API_BASE}/tasks/${taskId}`, {
             method: 'DELETE',
@@ -182,7 +228,9 @@ async function deleteTask(taskId) {
         const data = await response.json();
         updateStatus(response.ok ? data.message : data.error);
         if (response.ok) loadTasks();
+        else ownChanges.delete(taskId);
     } catch (error) {
+        ownChanges.delete(taskId);
         updateStatus('Error: ' + error.message);
     }
 }